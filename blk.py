@@ -3,14 +3,158 @@ from collections import UserDict
 import os
 import pprint
 import glob
-from pci import ModuleAlias
+import itertools
+import operator
+import sys
+import time
+from array import array
+from pci import BDF, ModuleAlias, PCIDevice, cpu_list_parse, numa_nodes
 SECTOR_SIZE = 512
+STAT_KEYS = (
+    'read',
+    'read_merge',
+    'read_sector',
+    'read_ticks',
+    'write',
+    'write_merge',
+    'write_sector',
+    'write_tick',
+    'in_flight',
+    'io_ticks',
+    'time_in_queue',
+    'discard',
+    'discard_merge',
+    'discard_sector',
+    'discard_tick',
+    'flush',
+    'flush_tick',
+)
+STAT_FIELDS = STAT_KEYS.__len__()
+(READ, READ_MERGE, READ_SECTOR, READ_TICKS, WRITE, WRITE_MERGE, WRITE_SECTOR, WRITE_TICK,
+ IN_FLIGHT, IO_TICKS, TIME_IN_QUEUE) = range(11)
+# counters printed as 32 bit millisecond ticks, these may wrap
+TICK_FIELDS = tuple(key.endswith(('_ticks', '_tick')) or key == 'time_in_queue' for key in STAT_KEYS)
+ALIAS_TYPES = ('id', 'uuid', 'partuuid', 'label', 'partlabel', 'path')
+DISKSTATS_PATH = '/proc/diskstats'
+QUEUE_KEYS = {
+    'scheduler': str,
+    'nr_requests': int,
+    'rotational': lambda value: value == '1',
+    'read_ahead_kb': int,
+    'max_sectors_kb': int,
+    'max_hw_sectors_kb': int,
+    'logical_block_size': int,
+    'physical_block_size': int,
+    'minimum_io_size': int,
+    'optimal_io_size': int,
+    'discard_granularity': int,
+    'chunk_sectors': int,
+    'write_cache': str,
+    'nomerges': int,
+    'rq_affinity': int,
+}
+# kernel default read ahead, less than this starves sequential reads on a disk
+READ_AHEAD_MIN_KB = 128
+# BLK_DEF_MAX_SECTORS_CAP, larger requests are not built by the kernel anyway
+MAX_SECTORS_LIMIT_KB = 4096
+# a hardware queue serving more than this many times its fair share of CPUs
+MQ_CROWDED_FACTOR = 2
+# rates that add up across the devices of one stack layer
+SUM_KEYS = ('r/s', 'w/s', 'rMB/s', 'wMB/s', 'aqu-sz')
+# boundaries a partition start should sit on, (name, queue key, bytes per unit),
+# discard_granularity is the erase block of flash, chunk_sectors the stripe
+ALIGNMENT_KEYS = (
+    ('physical_block_size', 'physical_block_size', 1),
+    ('minimum_io_size', 'minimum_io_size', 1),
+    ('optimal_io_size', 'optimal_io_size', 1),
+    ('erase_block', 'discard_granularity', 1),
+    ('stripe', 'chunk_sectors', SECTOR_SIZE),
+)
+
+
+def disk_aliases(prefix='/dev/disk'):
+    """
+    one pass over every /dev/disk/by-* directory:
+    {kernel name: {'id': [...], 'uuid': [...], 'partuuid': [...], ...}}
+    """
+    aliases = {}
+    for alias_type in ALIAS_TYPES:
+        try:
+            entries = list(os.scandir(os.path.join(prefix, 'by-' + alias_type)))
+        except FileNotFoundError:
+            continue
+        for entry in sorted(entries, key=lambda e: e.name):
+            try:
+                name = os.path.basename(os.readlink(entry.path))
+            except OSError:
+                continue
+            aliases.setdefault(name, {}).setdefault(alias_type, []).append(entry.name)
+    return aliases
+
+
+class DiskStats:
+    """
+    every disk and partition counter from a single read of /proc/diskstats:
+    names, a flat array of STAT_FIELDS counters per line and a
+    'major:minor' -> row index, older kernels' shorter lines are padded with zeros
+    """
+    def __init__(self, path=DISKSTATS_PATH):
+        self.path = path
+        self.names = []
+        self.rows = {}
+        self.counts = array('Q')
+        self.read()
+
+    def read(self):
+        with open(self.path)as fp:
+            lines = fp.read().splitlines()
+        names = []
+        rows = {}
+        counts = array('Q')
+        for line in lines:
+            fields = line.split()
+            if fields.__len__() < 4:
+                continue
+            values = fields[3:3 + STAT_FIELDS]
+            values += ['0'] * (STAT_FIELDS - values.__len__())
+            rows[fields[0] + ':' + fields[1]] = names.__len__()
+            # cciss/c0d0 here is cciss!c0d0 under /sys/block
+            names.append(fields[2].replace('/', '!'))
+            counts.extend(map(int, values))
+        self.names, self.rows, self.counts = names, rows, counts
+        return self
+
+    def __call__(self):
+        """
+        IOStat source: re-read and return (names, counts)
+        """
+        self.read()
+        return self.names, self.counts
+
+    def __contains__(self, dev):
+        return dev in self.rows
+
+    def stat(self, dev: str) -> dict:
+        """
+        dev: 'major:minor' as in the sysfs dev attribute, {} if not listed
+        """
+        row = self.rows.get(dev)
+        if row is None:
+            return {}
+        return dict(zip(STAT_KEYS, self.counts[row * STAT_FIELDS:(row + 1) * STAT_FIELDS]))
 
 
 class BlockDevice(UserDict):
-    def __init__(self, dev_path: str, *args, **kwargs):
+    def __init__(self, dev_path: str, aliases=None, diskstats=None, *args, **kwargs):
+        """
+        aliases: disk_aliases() shared by every device of one scan
+        diskstats: DiskStats shared by every device of one scan, the stat
+        files are read one by one without it
+        """
         self.dev_path = dev_path
         self.dev_name = os.path.split(self.dev_path)[-1]
+        self._aliases = disk_aliases() if aliases is None else aliases
+        self._diskstats = diskstats
         super(BlockDevice, self).__init__(*args, **kwargs)
         module = ModuleAlias()
         keys = ['alignment_offset',
@@ -23,7 +167,6 @@ class BlockDevice(UserDict):
                 'events_async',
                 'inflight',
                 'range',
-                'stat',
                 'dev',
                 'events_poll_msecs',
                 'removable',
@@ -39,26 +182,69 @@ class BlockDevice(UserDict):
                 value = int(value.strip()) * SECTOR_SIZE
             self.__setitem__(key.split('/')[-1], value)
         self.__setitem__('module', module.find(self.modalias))
-        self.__setitem__('stat', self.stat_parse())
+        self.__setitem__('stat', self.stat_read(self.dev))
         self.__setitem__('id', self.parse_wwn())
+        self.__setitem__('aliases', self._aliases.get(self.dev_name, {}))
         self.__setitem__('name', self.dev_name)
+        self.__setitem__('queue', self.queue_parse())
+        self.__setitem__('mq', self.mq_parse())
         self.part_parse()
 
     def __getattr__(self, item):
         return self.get(item, '')
 
     def parse_wwn(self):
-        disk_id = []
-        for dev_name in glob.glob('/dev/disk/by-id/*'):
-            if os.path.split(os.readlink(dev_name))[-1] == self.dev_name:
-                disk_id.append(os.path.split(dev_name)[-1])
-        return disk_id
+        return list(self._aliases.get(self.dev_name, {}).get('id', []))
 
-    @staticmethod
-    def uuid_parse(part_name):
-        for dev_name in glob.glob('/dev/disk/by-uuid/*'):
-            if os.path.split(os.readlink(dev_name))[-1] == part_name:
-                return os.path.split(dev_name)[-1]
+    def uuid_parse(self, part_name):
+        uuids = self._aliases.get(part_name, {}).get('uuid')
+        if uuids:
+            return uuids[0]
+
+    def queue_parse(self) -> dict:
+        """
+        queue/ attributes converted by QUEUE_KEYS, None when the driver has no
+        such attribute, scheduler is the active one and schedulers all choices:
+        'none [mq-deadline] kyber' -> 'mq-deadline', ['none', 'mq-deadline', 'kyber']
+        """
+        queue_path = os.path.join(self.dev_path, 'queue')
+        queue = {}
+        for key, convert in QUEUE_KEYS.items():
+            value = self.read_attr(key, queue_path)
+            queue[key] = convert(value) if value else None
+        schedulers = (queue['scheduler'] or '').split()
+        queue['schedulers'] = [name.strip('[]') for name in schedulers]
+        queue['scheduler'] = next((name.strip('[]') for name in schedulers if name.startswith('[')),
+                                  'none' if schedulers else None)
+        return queue
+
+    def mq_parse(self) -> list:
+        """
+        blk-mq hardware queues: [{'queue', 'cpus', 'nr_tags', 'nr_reserved_tags'}, ...],
+        empty for devices without mq/
+        """
+        queues = []
+        for queue_path in glob.glob(os.path.join(self.dev_path, 'mq', '*')):
+            try:
+                queue = int(os.path.basename(queue_path))
+            except ValueError:
+                continue
+            queues.append({'queue': queue,
+                           'cpus': sorted(cpu_list_parse(self.read_attr('cpu_list', queue_path))),
+                           'nr_tags': int(self.read_attr('nr_tags', queue_path) or 0),
+                           'nr_reserved_tags': int(self.read_attr('nr_reserved_tags', queue_path) or 0)})
+        return sorted(queues, key=lambda q: q['queue'])
+
+    @property
+    def pci_controller(self):
+        """
+        bdf of the PCI function nearest to the device, None when not behind PCI
+        """
+        bdf = None
+        for name in os.path.realpath(self.dev_path).split(os.sep):
+            if BDF.match(name):
+                bdf = name
+        return bdf
 
     def part_parse(self):
         part_path = os.path.join(self.dev_path, self.dev_name + '*')
@@ -69,7 +255,6 @@ class BlockDevice(UserDict):
                     'discard_alignment',
                     'inflight',
                     'size',
-                    'stat',
                     'dev',
                     'partition',
                     'ro',
@@ -78,16 +263,21 @@ class BlockDevice(UserDict):
             part_name = os.path.split(part)[-1]
             for key in keys:
                 value = self.read_attr(key, part)
-                if key == 'stat':
-                    value = self.stat_parse(value)
                 if key == 'size':
                     value = int(value) * SECTOR_SIZE
                 part_info[key] = value
+            part_info['stat'] = self.stat_read(part_info['dev'], part)
             part_info['uuid'] = self.uuid_parse(part_name)
+            part_info['aliases'] = self._aliases.get(part_name, {})
             part_info['name'] = part_name
             parts.append(part_info)
             self.__setitem__('part', parts)
 
+    def stat_read(self, dev, path=None):
+        if self._diskstats is not None:
+            return self._diskstats.stat(dev)
+        return self.stat_parse(self.read_attr('stat', path))
+
     def stat_parse(self, stat=None):
         """
         read I/Os	    requests	    number of read I/Os processed
@@ -109,31 +299,12 @@ class BlockDevice(UserDict):
         flush ticks
         :return:
         """
-        keys = [
-            'read',
-            'read_merge',
-            'read_sector',
-            'read_ticks',
-            'write',
-            'write_merge',
-            'write_sector',
-            'write_tick',
-            'in_flight',
-            'io_ticks',
-            'time_in_queue',
-            'discard',
-            'discard_merge',
-            'discard_sector',
-            'discard_tick',
-            'flush',
-            'flush_tick',
-        ]
         if stat is None:
             values = self.stat.split()
         else:
             values = stat.split()
         values = [int(v) for v in values]
-        return dict(zip(keys, values))
+        return dict(zip(STAT_KEYS, values))
 
     def read_attr(self, name: str, path=None):
         if path is None:
@@ -158,6 +329,458 @@ class BlockDevice(UserDict):
         return self.__str__()
 
 
+def scan_blk(prefix='/sys/block'):
+    """
+    every block device, sharing one disk_aliases() and one DiskStats read,
+    devices gone before they could be read are skipped
+    """
+    aliases = disk_aliases()
+    diskstats = DiskStats() if os.path.exists(DISKSTATS_PATH) else None
+    devices = []
+    for path in sorted(glob.glob(os.path.join(prefix, '*'))):
+        try:
+            devices.append(BlockDevice(path, aliases, diskstats))
+        except (OSError, ValueError):
+            continue
+    return devices
+
+
+def queue_advice(devices=None):
+    """
+    queue/ settings known to hurt, each with the value to write instead:
+    [{'name', 'key', 'value', 'recommended', 'reason', 'path'}, ...]
+    """
+    if devices is None:
+        devices = scan_blk()
+    advice = []
+    for dev in devices:
+        queue = dev.queue
+
+        def recommend(key, value, reason):
+            advice.append({'name': dev.dev_name,
+                           'key': key,
+                           'value': queue[key],
+                           'recommended': value,
+                           'reason': reason,
+                           'path': os.path.join(dev.dev_path, 'queue', key)})
+
+        scheduler = queue['scheduler']
+        if dev.dev_name.startswith('nvme') and scheduler not in (None, 'none') and 'none' in queue['schedulers']:
+            recommend('scheduler', 'none', 'NVMe queues are deep enough, {} only adds latency'.format(scheduler))
+        elif queue['rotational'] and scheduler == 'none' and 'mq-deadline' in queue['schedulers']:
+            recommend('scheduler', 'mq-deadline', 'rotational disk without request sorting')
+        if queue['rotational'] and queue['read_ahead_kb'] is not None and queue['read_ahead_kb'] < READ_AHEAD_MIN_KB:
+            recommend('read_ahead_kb', READ_AHEAD_MIN_KB, 'read ahead too small for a rotational disk')
+        if queue['max_sectors_kb'] is not None and queue['max_hw_sectors_kb'] is not None:
+            limit = min(queue['max_hw_sectors_kb'], MAX_SECTORS_LIMIT_KB)
+            if queue['max_sectors_kb'] < limit:
+                recommend('max_sectors_kb', limit,
+                          'requests split below the hardware maximum of {} kB'.format(queue['max_hw_sectors_kb']))
+    return advice
+
+
+def print_queue_advice(devices=None, writes=False):
+    """
+    writes: only print the sysfs writes, nothing is applied
+    """
+    for entry in queue_advice(devices):
+        if writes:
+            print('echo {} > {}'.format(entry['recommended'], entry['path']))
+        else:
+            print('{:<12} {} {} -> {}: {}'.format(
+                entry['name'], entry['key'], entry['value'], entry['recommended'], entry['reason']))
+
+
+def mq_report(devices=None, pci_prefix='/sys/bus/pci/devices'):
+    """
+    hardware queue to CPU mapping of every multi-queue device with the NUMA
+    node of its PCI controller, queues serving remote-node CPUs or more than
+    MQ_CROWDED_FACTOR times their share of CPUs are flagged
+    """
+    if devices is None:
+        devices = scan_blk()
+    nodes = numa_nodes()
+    report = []
+    for dev in devices:
+        if not dev.mq:
+            continue
+        bdf = dev.pci_controller
+        node = -1
+        local = set()
+        if bdf is not None:
+            controller = PCIDevice(os.path.join(pci_prefix, bdf), lazy=True)
+            try:
+                node = int(controller.numa_node)
+            except ValueError:
+                node = -1
+            local = controller.local_cpu_set or nodes.get(node, set())
+            if local == set().union(*nodes.values()):
+                # every CPU is local on single node machines
+                local = set()
+        cpus = sum(q['cpus'].__len__() for q in dev.mq)
+        share = cpus / dev.mq.__len__()
+        queues = []
+        for q in dev.mq:
+            remote = sorted(set(q['cpus']) - local) if local else []
+            crowded = dev.mq.__len__() > 1 and q['cpus'].__len__() > share * MQ_CROWDED_FACTOR
+            queues.append(dict(q, remote_cpus=remote, crowded=crowded))
+        report.append({'name': dev.dev_name,
+                       'controller': bdf,
+                       'numa_node': node,
+                       'queues': queues,
+                       'flagged': any(q['remote_cpus'] or q['crowded'] for q in queues)})
+    return report
+
+
+def print_mq_report(devices=None):
+    for entry in mq_report(devices):
+        print('{:<8} {} controller {} node {} queues {}'.format(
+            'UNEVEN' if entry['flagged'] else 'ok',
+            entry['name'],
+            entry['controller'],
+            entry['numa_node'],
+            entry['queues'].__len__()))
+        for q in entry['queues']:
+            print('\t{:>3} tags {:>5} cpus {}{}{}'.format(
+                q['queue'],
+                q['nr_tags'],
+                ','.join(map(str, q['cpus'])),
+                ' CROWDED' if q['crowded'] else '',
+                ' REMOTE: {}'.format(','.join(map(str, q['remote_cpus']))) if q['remote_cpus'] else ''))
+
+
+def alignment_report(devices=None):
+    """
+    start and size of every partition checked against the boundaries of its
+    disk, boundaries count from the disk's alignment_offset, 0 means unset:
+    [{'name', 'disk', 'start', 'size', 'alignment_offset',
+      'checks': {name: {'boundary', 'off'}}, 'size_off', 'flagged'}, ...]
+    """
+    if devices is None:
+        devices = scan_blk()
+    report = []
+    for dev in devices:
+        queue = dev.queue
+        disk_offset = int(dev.alignment_offset or 0)
+        boundaries = []
+        for name, key, unit in ALIGNMENT_KEYS:
+            boundary = (queue.get(key) or 0) * unit
+            if boundary > (queue['logical_block_size'] or SECTOR_SIZE):
+                boundaries.append((name, boundary))
+        for part in dev.part or []:
+            start = int(part['start'] or 0) * SECTOR_SIZE
+            checks = {name: {'boundary': boundary, 'off': (start - disk_offset) % boundary}
+                      for name, boundary in boundaries}
+            # the end only matters for whole physical blocks
+            size_off = part['size'] % queue['physical_block_size'] if queue['physical_block_size'] else 0
+            report.append({'name': part['name'],
+                           'disk': dev.dev_name,
+                           'start': start,
+                           'size': part['size'],
+                           'alignment_offset': int(part['alignment_offset'] or 0),
+                           'checks': checks,
+                           'size_off': size_off,
+                           'flagged': size_off > 0 or any(check['off'] for check in checks.values())})
+    return report
+
+
+def print_alignment_report(devices=None):
+    for entry in alignment_report(devices):
+        problems = ['{} {}: {} bytes off'.format(name, check['boundary'], check['off'])
+                    for name, check in entry['checks'].items() if check['off']]
+        if entry['size_off']:
+            problems.append('size: {} bytes past the last physical block'.format(entry['size_off']))
+        print('{:<8} {} start {} size {}{}'.format(
+            'MISALIGN' if entry['flagged'] else 'ok',
+            entry['name'],
+            entry['start'],
+            entry['size'],
+            ''.join('\n\t' + problem for problem in problems)))
+
+
+def read_block_stats(prefix='/sys/block'):
+    """
+    stat of every disk and partition: ([name, ...], flat array of STAT_FIELDS
+    counters per name), older kernels' shorter lines are padded with zeros
+    """
+    names = []
+    counts = array('Q')
+    for stat_path in sorted(glob.glob(os.path.join(prefix, '*', 'stat')) +
+                            glob.glob(os.path.join(prefix, '*', '*', 'stat'))):
+        if not os.path.exists(os.path.join(os.path.dirname(stat_path), 'dev')):
+            # skip queue/, mq/... which are not block devices
+            continue
+        try:
+            with open(stat_path)as fp:
+                values = fp.read().split()
+        except OSError:
+            continue
+        values = values[:STAT_FIELDS] + ['0'] * (STAT_FIELDS - values.__len__())
+        names.append(os.path.basename(os.path.dirname(stat_path)))
+        counts.extend(map(int, values))
+    return names, counts
+
+
+class IOStat:
+    """
+    iostat-style rates from consecutive snapshots of the block counters,
+    the previous snapshot is kept as one flat (device x STAT_FIELDS) array,
+    source is a DiskStats unless given
+    """
+    def __init__(self, source=None):
+        if source is None:
+            source = DiskStats() if os.path.exists(DISKSTATS_PATH) else read_block_stats
+        self.source = source
+        self.names = {}
+        # name -> row
+        self.counts = array('Q')
+        self.timestamp = None
+
+    @staticmethod
+    def delta(counts, old_counts):
+        deltas = array('q', map(operator.sub, counts, old_counts))
+        if deltas and min(deltas) < 0:
+            deltas = array('q', map(IOStat.unwrap, deltas, old_counts, itertools.cycle(TICK_FIELDS)))
+        return deltas
+
+    @staticmethod
+    def unwrap(d, old, tick):
+        if d >= 0:
+            return d
+        # millisecond tick counters are 32 bit on some kernels, anything else
+        # going backwards means the device was reset
+        if tick and old < 1 << 32:
+            d += 1 << 32
+        return max(d, 0)
+
+    def sample(self):
+        """
+        [{'name', 'r/s', 'w/s', 'rMB/s', 'wMB/s', 'r_await', 'w_await', 'await',
+          'aqu-sz', '%util'}, ...] since the previous sample, empty on the first
+        """
+        now = time.monotonic()
+        names, counts = self.source()
+        rows = {name: row for row, name in enumerate(names)}
+        report = []
+        if self.timestamp is not None and now > self.timestamp:
+            if rows == self.names:
+                old_counts = self.counts
+            else:
+                # devices came or went, line the old rows up with the new ones
+                old_counts = array('Q', counts)
+                for name, row in rows.items():
+                    old_row = self.names.get(name)
+                    if old_row is not None:
+                        old_counts[row * STAT_FIELDS:(row + 1) * STAT_FIELDS] = \
+                            self.counts[old_row * STAT_FIELDS:(old_row + 1) * STAT_FIELDS]
+            report = self.rates(names, self.delta(counts, old_counts), now - self.timestamp)
+        self.names, self.counts, self.timestamp = rows, counts, now
+        return report
+
+    @staticmethod
+    def rates(names, deltas, seconds):
+        ms = seconds * 1000
+        report = []
+        for row, name in enumerate(names):
+            d = deltas[row * STAT_FIELDS:(row + 1) * STAT_FIELDS]
+            ios = d[READ] + d[WRITE]
+            report.append({
+                'name': name,
+                'r/s': d[READ] / seconds,
+                'w/s': d[WRITE] / seconds,
+                'rMB/s': d[READ_SECTOR] * SECTOR_SIZE / 1e6 / seconds,
+                'wMB/s': d[WRITE_SECTOR] * SECTOR_SIZE / 1e6 / seconds,
+                'r_await': d[READ_TICKS] / d[READ] if d[READ] else 0.0,
+                'w_await': d[WRITE_TICK] / d[WRITE] if d[WRITE] else 0.0,
+                'await': (d[READ_TICKS] + d[WRITE_TICK]) / ios if ios else 0.0,
+                'aqu-sz': d[TIME_IN_QUEUE] / ms,
+                '%util': min(d[IO_TICKS] / ms * 100, 100.0),
+            })
+        return report
+
+
+class BlockGraph:
+    """
+    block devices and partitions linked by holders/ and slaves/: dm-crypt, LVM,
+    md and multipath sit above the devices they are built from, a partition
+    sits above its disk; lower leads towards the physical disks
+    """
+    def __init__(self, devices=None):
+        if devices is None:
+            devices = scan_blk()
+        self.nodes = {}
+        self.lower = {}
+        self.upper = {}
+        for dev in devices:
+            self._add(dev.dev_name, dev, dev.dev_path)
+            for part in dev.part or []:
+                self._add(part['name'], part, os.path.join(dev.dev_path, part['name']))
+                self._link(part['name'], dev.dev_name)
+        for name in self.nodes:
+            self.lower[name] = [lower for lower in self.lower[name] if lower in self.nodes]
+            self.upper[name] = [upper for upper in self.upper[name] if upper in self.nodes]
+
+    def _add(self, name, device, path):
+        self.nodes[name] = device
+        self.lower.setdefault(name, [])
+        self.upper.setdefault(name, [])
+        for holder in self._list(os.path.join(path, 'holders')):
+            self._link(holder, name)
+        for slave in self._list(os.path.join(path, 'slaves')):
+            self._link(name, slave)
+
+    def _link(self, upper, lower):
+        if lower not in self.lower.setdefault(upper, []):
+            self.lower[upper].append(lower)
+        if upper not in self.upper.setdefault(lower, []):
+            self.upper[lower].append(upper)
+
+    @staticmethod
+    def _list(path):
+        try:
+            return sorted(os.listdir(path))
+        except OSError:
+            return []
+
+    def _reach(self, name, edges):
+        """
+        the ends of every path from name along edges, name itself when it has none
+        """
+        ends = []
+        stack = [name]
+        seen = set()
+        while stack:
+            node = stack.pop()
+            if node in seen:
+                continue
+            seen.add(node)
+            if edges[node]:
+                stack.extend(edges[node])
+            elif node not in ends:
+                ends.append(node)
+        return sorted(ends)
+
+    def physical(self, name):
+        return self._reach(name, self.lower)
+
+    def logical(self, name):
+        return self._reach(name, self.upper)
+
+    @property
+    def tops(self):
+        return sorted(name for name in self.nodes if not self.upper[name])
+
+    @staticmethod
+    def combine(entries):
+        """
+        SUM_KEYS added up, await weighted by each device's I/O rate
+        """
+        total = dict.fromkeys(SUM_KEYS, 0.0)
+        waited = 0.0
+        for entry in entries:
+            for key in SUM_KEYS:
+                total[key] += entry[key]
+            waited += entry['await'] * (entry['r/s'] + entry['w/s'])
+        ios = total['r/s'] + total['w/s']
+        total['await'] = waited / ios if ios else 0.0
+        return total
+
+    def report(self, rates):
+        """
+        rates: IOStat.sample() output; per node its own rates, the combined
+        rates of the layer below, the physical disks and logical tops it
+        belongs to and the await it adds over the layer below
+        """
+        by_name = {entry['name']: entry for entry in rates}
+        idle = dict.fromkeys(SUM_KEYS + ('await',), 0.0)
+        report = {}
+        for name in self.nodes:
+            own = by_name.get(name, idle)
+            entry = {'name': name,
+                     'rates': own,
+                     'lower': self.lower[name],
+                     'upper': self.upper[name],
+                     'physical': self.physical(name),
+                     'logical': self.logical(name),
+                     'lower_rates': None,
+                     'await_delta': 0.0}
+            if self.lower[name]:
+                lower = self.combine(by_name.get(lower, idle) for lower in self.lower[name])
+                entry['lower_rates'] = lower
+                entry['await_delta'] = own['await'] - lower['await']
+            entry['physical_rates'] = self.combine(by_name.get(disk, idle) for disk in entry['physical'])
+            entry['logical_rates'] = self.combine(by_name.get(top, idle) for top in entry['logical'])
+            report[name] = entry
+        return report
+
+
+def print_block_graph(graph=None, interval=1.0, stats=None):
+    graph = graph or BlockGraph()
+    stats = stats or IOStat()
+    stats.sample()
+    time.sleep(interval)
+    report = graph.report(stats.sample())
+
+    def show(name, depth):
+        entry = report[name]
+        rates = entry['rates']
+        print('{}{} r/s {:.1f} w/s {:.1f} await {:.2f}{}'.format(
+            '\t' * depth + ('|__ ' if depth else ''),
+            name,
+            rates['r/s'],
+            rates['w/s'],
+            rates['await'],
+            ' (+{:.2f} over {})'.format(entry['await_delta'], ','.join(entry['lower']))
+            if entry['lower'] else ''))
+        for lower in entry['lower']:
+            show(lower, depth + 1)
+
+    for top in graph.tops:
+        # plain disks without partitions or holders are not stacks
+        if graph.lower[top]:
+            show(top, 0)
+
+
+def iostat(interval=1.0, count=None, stats=None):
+    stats = stats or IOStat()
+    stats.sample()
+    header = '{:<12} {:>9} {:>9} {:>9} {:>9} {:>8} {:>8} {:>7} {:>6}'
+    row = '{name:<12} {r/s:>9.1f} {w/s:>9.1f} {rMB/s:>9.2f} {wMB/s:>9.2f} {r_await:>8.2f} ' \
+          '{w_await:>8.2f} {aqu-sz:>7.2f} {%util:>6.1f}'
+    while count is None or count > 0:
+        time.sleep(interval)
+        print(header.format('Device', 'r/s', 'w/s', 'rMB/s', 'wMB/s', 'r_await', 'w_await', 'aqu-sz', '%util'))
+        for entry in stats.sample():
+            print(row.format(**entry))
+        print()
+        if count is not None:
+            count -= 1
+
+
 if __name__ == '__main__':
-    for blk_path in glob.glob('/sys/block/*'):
-        pprint.pprint(BlockDevice(blk_path).data)
+    if sys.argv[1:2] == ['-i']:
+        iostat(float(sys.argv[2]) if sys.argv[2:] else 1.0)
+        sys.exit(0)
+    if sys.argv[1:2] == ['-q']:
+        print_queue_advice()
+        sys.exit(0)
+    if sys.argv[1:2] == ['-w']:
+        print_queue_advice(writes=True)
+        sys.exit(0)
+    if sys.argv[1:2] == ['-m']:
+        print_mq_report()
+        sys.exit(0)
+    if sys.argv[1:2] == ['-a']:
+        print_alignment_report()
+        sys.exit(0)
+    if sys.argv[1:2] == ['-s']:
+        print_block_graph(interval=float(sys.argv[2]) if sys.argv[2:] else 1.0)
+        sys.exit(0)
+    if sys.argv[1:2] == ['-h']:
+        print('Usage:\n\t-i [interval]  iostat style rates\n\t-q  queue tuning advice'
+              '\n\t-w  sysfs writes the advice recommends, not applied\n\t-m  blk-mq queue to CPU mapping'
+              '\n\t-a  partition alignment\n\t-s [interval]  device stacks with await added per layer'
+              '\n\t-h  show this')
+        sys.exit(0)
+    for dev in scan_blk():
+        pprint.pprint(dev.data)
@@ -1,12 +1,143 @@
 #!/usr/bin/python3
-from collections import UserDict
 import os
+import sys
 import glob
+import fnmatch
+import re
+import mmap
+import struct
+import tempfile
+import time
+import itertools
+import operator
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# vendor, device, command, status, revision, prog_if, sub_class, base_class,
+# cache_line, latency_timer, header_type, bist
+CONFIG_HEADER = struct.Struct('<HHHHBBBBBBBB')
+CONFIG_KEYS = ('vendor', 'device', 'revision', 'class', 'subsystem_vendor', 'subsystem_device',
+               'max_link_speed', 'max_link_width', 'current_link_speed', 'current_link_width')
+PCI_STATUS_CAP_LIST = 0x10
+PCI_CAPABILITY_LIST = 0x34
+PCI_CAP_ID_EXP = 0x10
+PCI_EXP_LNKCAP = 0x0c
+PCI_EXP_LNKSTA = 0x12
+PCIE_SPEED = {1: '2.5 GT/s PCIe', 2: '5.0 GT/s PCIe', 3: '8.0 GT/s PCIe',
+              4: '16.0 GT/s PCIe', 5: '32.0 GT/s PCIe', 6: '64.0 GT/s PCIe'}
+PCIE_ASPM = ('l0s_aspm', 'l1_aspm', 'l1_1_aspm', 'l1_2_aspm', 'l1_1_pcipm', 'l1_2_pcipm')
+# storage, network and accelerators pay for every wake-up
+LATENCY_CRITICAL = ('01', '02', '12')
+BDF = re.compile(r'^[0-9a-f]{4}:[0-9a-f]{2}:[0-9a-f]{2}\.[0-7]$')
+
+
+class IdsCache:
+    """
+    compiled form of an ids database (pci.ids, usb.ids):
+        header | source path | record counts | records of each table | names
+    every record is (key, name offset, name length), sorted by key, so a lookup
+    is a binary search over the memory-mapped file instead of a full parse
+    """
+    cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'device_finder')
+    # magic, source mtime_ns, source size, path length, table count
+    header = struct.Struct('<8sqqII')
+    record = struct.Struct('<QII')
+
+    def __init__(self, ids, magic, parse, persist=True):
+        """
+        parse(ids) returns one {int key: bytes name} dict per table
+        """
+        self.ids = ids
+        self.magic = magic
+        self.parse = parse
+        self.tables = []
+        self.buf = self.load(persist)
+        _, _, _, path_len, count = self.header.unpack_from(self.buf)
+        offset = self.header.size + path_len
+        counts = struct.unpack_from('<{}I'.format(count), self.buf, offset)
+        offset += 4 * count
+        for n in counts:
+            self.tables.append((offset, n))
+            offset += n * self.record.size
+        self.names_offset = offset
+
+    @property
+    def cache_path(self):
+        return os.path.join(self.cache_dir, self.ids.strip('/').replace('/', '_') + '.cache')
+
+    def load(self, persist):
+        """
+        return the compiled form of ids, rebuilding the cache file when the
+        source path, mtime or size no longer match its header
+        """
+        st = os.stat(self.ids)
+        if persist:
+            try:
+                with open(self.cache_path, 'rb')as fp:
+                    buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, mtime, size, path_len, _ = self.header.unpack_from(buf)
+                source = buf[self.header.size:self.header.size + path_len]
+                if (magic, mtime, size, source) == (self.magic, st.st_mtime_ns, st.st_size, self.ids.encode()):
+                    return buf
+                buf.close()
+            except (OSError, ValueError, struct.error):
+                pass
+        buf = self.compile(st)
+        if persist:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+                with os.fdopen(fd, 'wb')as fp:
+                    fp.write(buf)
+                os.replace(tmp_path, self.cache_path)
+            except OSError:
+                pass
+        return buf
+
+    def compile(self, st):
+        tables = self.parse(self.ids)
+        path = self.ids.encode()
+        names = bytearray()
+        records = bytearray()
+        for table in tables:
+            for key in sorted(table):
+                # name offsets are relative to the string table that follows the records
+                records += self.record.pack(key, names.__len__(), table[key].__len__())
+                names += table[key]
+        buf = bytearray(self.header.pack(self.magic, st.st_mtime_ns, st.st_size, path.__len__(), tables.__len__()))
+        buf += path
+        buf += struct.pack('<{}I'.format(tables.__len__()), *(table.__len__() for table in tables))
+        buf += records + names
+        return bytes(buf)
+
+    def search(self, table, key):
+        """
+        name of key in the table-th table, '' if absent
+        """
+        offset, count = self.tables[table]
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key, name_offset, name_len = self.record.unpack_from(self.buf, offset + mid * self.record.size)
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                name_offset += self.names_offset
+                return self.buf[name_offset:name_offset + name_len].decode(errors='replace')
+        return ''
 
 
 class PCIInfo:
+    """
+    pci.ids lookups served from an IdsCache, tables: vendor, device, subsystem
+    """
     _instance = None
-    pci_data = {}
+    pci_ids = ['/usr/share/misc/pci.ids', '/usr/share/hwdata/pci.ids']
+    VENDOR, DEVICE, SUBSYSTEM = range(3)
+    _cache = None
 
     def __new__(cls, *args, **kwargs):
         if getattr(cls, '_instance') is None:
@@ -16,50 +147,82 @@ class PCIInfo:
 
     @staticmethod
     def _init():
-        PCIInfo.pci_data = {}
-        for ids in ['/usr/share/misc/pci.ids', '/usr/share/hwdata/pci.ids']:
-            if not os.path.exists(ids):
-                continue
-            with open(ids)as fp:
-                lines = fp.readlines()
-                for line in lines:
-                    line = line.strip('\n')
-                    if line.startswith('#') or not line.strip():
-                        continue
-                    elif line[:2] == '\t\t':
-                        try:
-                            sub_vendor, sub_device, subsystem_name = line.split(maxsplit=2)
-                        except ValueError:
+        PCIInfo._cache = None
+        for ids in PCIInfo.pci_ids:
+            if os.path.exists(ids):
+                PCIInfo._cache = IdsCache(ids, b'PCIIDS02', PCIInfo.parse)
+                break
+
+    @staticmethod
+    def parse(ids):
+        vendors, devices, subsystems = {}, {}, {}
+        vendor_id = None
+        with open(ids, 'rb')as fp:
+            for line in fp:
+                line = line.rstrip(b'\r\n')
+                if line.startswith(b'#') or not line.strip():
+                    continue
+                try:
+                    if line[:2] == b'\t\t':
+                        if vendor_id is None:
+                            continue
+                        fields = line.split(maxsplit=2)
+                        if fields.__len__() == 3:
+                            sub_vendor, sub_device, subsystem_name = fields
+                            sub_vendor = int(sub_vendor, 16)
+                        else:
                             sub_device, subsystem_name = line.split(maxsplit=1)
                             sub_vendor = vendor_id
-                        if sub_vendor not in PCIInfo.pci_data[vendor_id]['subsystem']:
-                            PCIInfo.pci_data[vendor_id]['subsystem'][sub_vendor] = {}
-                        PCIInfo.pci_data[vendor_id]['subsystem'][sub_vendor][sub_device] = subsystem_name
-                    elif line[:1] == '\t':
+                        key = vendor_id << 32 | sub_vendor << 16 | int(sub_device, 16)
+                        subsystems[key] = subsystem_name.strip()
+                    elif line[:1] == b'\t':
+                        if vendor_id is None:
+                            continue
                         device_id, device_name = line.split(maxsplit=1)
-                        PCIInfo.pci_data[vendor_id]['device'][device_id] = device_name.strip()
+                        devices[vendor_id << 16 | int(device_id, 16)] = device_name.strip()
                     else:
+                        # class lists ('C 02  Network controller') end the vendor section
                         vendor_id, vendor_name = line.split(maxsplit=1)
-                        if vendor_id not in PCIInfo.pci_data:
-                            PCIInfo.pci_data[vendor_id] = {'name': vendor_name.strip(),
-                                                           'device': {},
-                                                           'subsystem': {}}
+                        vendor_id = int(vendor_id, 16) if vendor_id.__len__() == 4 else None
+                        if vendor_id is not None:
+                            vendors.setdefault(vendor_id, vendor_name.strip())
+                except ValueError:
+                    continue
+        return vendors, devices, subsystems
+
+    def search(self, table, key):
+        if self._cache is None:
+            return ''
+        return self._cache.search(table, key)
 
     def find(self, vendor_id, device_id, sub_vendor=None, sub_device=None):
-        vendor_data = self.pci_data.get(vendor_id, {})
+        try:
+            vendor = int(vendor_id, 16)
+            device = int(device_id, 16)
+        except ValueError:
+            return '', '', ''
+        subsystem_name = ''
         if sub_vendor is not None and sub_device is not None:
-            subsystem_name = self.pci_data.get(vendor_id, {}).get('subsystem', {}) \
-                .get(sub_vendor, {}).get(sub_device, '')
-        else:
-            subsystem_name = ''
-        vendor_name = vendor_data.get('name', '')
-        device_name = vendor_data.get('device', {}).get(device_id, '')
-        return vendor_name, device_name, subsystem_name
+            try:
+                subsystem_name = self.search(self.SUBSYSTEM, vendor << 32 | int(sub_vendor, 16) << 16 | int(sub_device, 16))
+            except ValueError:
+                pass
+        return self.search(self.VENDOR, vendor), self.search(self.DEVICE, vendor << 16 | device), subsystem_name
 
 
 class ModuleAlias:
     _instance = None
-    data = {}
+    # bus prefix -> literal pattern prefix -> [(order added, pattern, module name)],
+    # pattern is None for aliases without wildcards
+    index = {}
+    _order = itertools.count()
+    # (bus, literal prefix) -> [(order added, match or None, module name)], filled
+    # the first time a bucket is tested
+    _compiled = {}
+    # bus prefix -> sorted literal prefix lengths present in index[bus]
+    prefix_lengths = {}
+    _cache = {}
+    wildcard = re.compile(r'[*?\[]')
 
     def __new__(cls, *args, **kwargs):
         if getattr(cls, '_instance') is None:
@@ -69,32 +232,79 @@ class ModuleAlias:
 
     @staticmethod
     def _init():
+        ModuleAlias.index = {}
+        ModuleAlias.prefix_lengths = {}
+        ModuleAlias._compiled = {}
+        ModuleAlias._order = itertools.count()
+        ModuleAlias._cache = {}
         ModuleAlias._module_alias_path = os.path.join('/lib/modules', os.uname().release, 'modules.alias')
         if not os.path.exists(ModuleAlias._module_alias_path):
             ModuleAlias._module_alias_path = None
-            ModuleAlias.data = []
-        else:
-            with open(ModuleAlias._module_alias_path)as fp:
-                ModuleAlias.data = fp.readlines()
+            return
+        with open(ModuleAlias._module_alias_path)as fp:
+            for line in fp:
+                if not line.startswith('alias '):
+                    continue
+                ModuleAlias.add(*ModuleAlias._parse(line))
+        for bus, buckets in ModuleAlias.index.items():
+            ModuleAlias.prefix_lengths[bus] = sorted(set(map(len, buckets)))
+
+    @staticmethod
+    def add(pattern: str, module_name: str):
+        """
+        index one alias by bus and by the literal text before its first wildcard,
+        so a lookup only tests the patterns that can possibly match; patterns are
+        compiled when their bucket is first tested
+        """
+        literal = ModuleAlias.wildcard.split(pattern, 1)[0]
+        bus = literal.split(':', 1)[0]
+        ModuleAlias.index.setdefault(bus, {}).setdefault(literal, []).append(
+            (next(ModuleAlias._order), None if literal == pattern else pattern, module_name))
+        ModuleAlias._compiled.pop((bus, literal), None)
+
+    @staticmethod
+    def _bucket(bus, literal):
+        compiled = ModuleAlias._compiled.get((bus, literal))
+        if compiled is None:
+            compiled = ModuleAlias._compiled[bus, literal] = [
+                (order, pattern and re.compile(fnmatch.translate(pattern)).match, module_name)
+                for order, pattern, module_name in ModuleAlias.index[bus][literal]]
+        return compiled
 
     def find(self, module_alias: str):
-        modules = []
-        for line in self.data:
-            if line.startswith('#'):
-                continue
-            if not self.type_match(line, module_alias):
+        """
+        modules whose alias matches, in modules.alias order
+        """
+        modules = self._cache.get(module_alias)
+        if modules is not None:
+            return list(modules)
+        matches = []
+        bus = module_alias.split(':', 1)[0]
+        buckets = self.index.get(bus, {})
+        for length in self.prefix_lengths.get(bus, ()):
+            if length > module_alias.__len__():
+                break
+            if module_alias[:length] not in buckets:
                 continue
-            _pattern, _module_name = self._parse(line)
-            if self.match(module_alias, _pattern):
-                if _module_name not in modules:
-                    modules.append(_module_name)
-        return modules
+            for order, match, _module_name in self._bucket(bus, module_alias[:length]):
+                if match is None:
+                    if length != module_alias.__len__():
+                        continue
+                elif match(module_alias) is None:
+                    continue
+                matches.append((order, _module_name))
+        modules = []
+        for _, _module_name in sorted(matches):
+            if _module_name not in modules:
+                modules.append(_module_name)
+        self._cache[module_alias] = modules
+        return list(modules)
 
-    @staticmethod
-    def type_match(line, pattern):
-        if line[6:].startswith(pattern.split(':')[0]):
-            return True
-        return False
+    def find_many(self, module_aliases):
+        """
+        resolve a batch of modalias strings, return {modalias: [module, ...]}
+        """
+        return {module_alias: self.find(module_alias) for module_alias in module_aliases}
 
     @staticmethod
     def _parse(line):
@@ -109,75 +319,172 @@ class ModuleAlias:
 
     @staticmethod
     def match(string: str, pattern: str):
-        if string == pattern:
-            return True
-        for pat in pattern.split('*'):
-            if pat not in string:
-                return False
-        return True
-
-
-class PCIDevice(UserDict):
-    def __init__(self, dev_path: str, *args, **kwargs):
-        super(PCIDevice, self).__init__(*args, **kwargs)
-        self.info = PCIInfo()
+        return fnmatch.fnmatchcase(string, pattern)
+
+
+class PCIDevice:
+    attr_keys = ('class',
+                 # PCI class (ascii, ro)
+                 # 'config',
+                 # PCI config space (binary, rw)
+                 'device',
+                 # PCI device (ascii, ro)
+                 'enable',
+                 # Whether the device is enabled (ascii, rw)
+                 'irq',
+                 # IRQ number (ascii, ro)
+                 'local_cpus',
+                 # nearby CPU mask (cpumask, ro)
+                 'numa_node',
+                 # NUMA node of the device, -1 if unknown (ascii, ro)
+                 # 'remove',
+                 # remove device from kernel’s list (ascii, wo)
+                 'resource',
+                 # PCI resource host addresses (ascii, ro)
+                 # resource0..N	PCI resource N, if present (binary, mmap, rw[1])
+                 # resource0_wc..N_wc	PCI WC map resource N, if prefetchable (binary, mmap)
+                 'revision',
+                 # PCI revision (ascii, ro)
+                 # 'rom',
+                 # PCI ROM resource, if present (binary, ro)
+                 'subsystem_device',
+                 # PCI subsystem device (ascii, ro)
+                 'subsystem_vendor',
+                 # PCI subsystem vendor (ascii, ro)
+                 'vendor',
+                 # PCI vendor (ascii, ro)
+                 'modalias',
+                 'max_link_speed',
+                 # GT/s
+                 'max_link_width',
+                 'current_link_speed',
+                 # negotiated GT/s
+                 'current_link_width'
+                 )
+    __slots__ = ('dev_path', 'domain', 'bus', 'device_number', 'device_function',
+                 '_attrs', '_config', '_driver', '_dev_name', '_sub_name', '_modules', '_dev_type', '_devices')
+
+    def __init__(self, dev_path: str, lazy=False):
+        """
+        with lazy=True sysfs attributes are read on first access and derived
+        fields (dev_name, modules, devices, ...) are computed on first use
+        """
         self.dev_path = dev_path
         self.domain, self.bus, device = dev_path.split(':')
         # PCI domain, bus number
         self.device_number, self.device_function = device.split('.')
         # the device number, PCI device function
-        keys = ['class',
-                # PCI class (ascii, ro)
-                # 'config',
-                # PCI config space (binary, rw)
-                'device',
-                # PCI device (ascii, ro)
-                'enable',
-                # Whether the device is enabled (ascii, rw)
-                'irq',
-                # IRQ number (ascii, ro)
-                'local_cpus',
-                # nearby CPU mask (cpumask, ro)
-                # 'remove',
-                # remove device from kernel’s list (ascii, wo)
-                'resource',
-                # PCI resource host addresses (ascii, ro)
-                # resource0..N	PCI resource N, if present (binary, mmap, rw[1])
-                # resource0_wc..N_wc	PCI WC map resource N, if prefetchable (binary, mmap)
-                'revision',
-                # PCI revision (ascii, ro)
-                # 'rom',
-                # PCI ROM resource, if present (binary, ro)
-                'subsystem_device',
-                # PCI subsystem device (ascii, ro)
-                'subsystem_vendor',
-                # PCI subsystem vendor (ascii, ro)
-                'vendor',
-                # PCI vendor (ascii, ro)
-                'modalias',
-                'max_link_speed',
-                # GT/s
-                'max_link_width'
-                ]
-        m = ModuleAlias()
-        for k in keys:
-            self.__setitem__(k, self.read_attr(k))
-        self.driver = self.read_driver()
-        self.dev_name = ' '.join(self.info.find(self.vendor[2:],
-                                                self.device[2:],
-                                                self.subsystem_vendor[2:],
-                                                self.subsystem_device[2:])
-                                 )
-        self.sub_name = ' '.join(self.info.find(self.subsystem_vendor[2:],
-                                                self.subsystem_device[2:])
-                                 )
-        self.modules = m.find(self.modalias)
-        self.dev_type_name, self.dev_type = self.get_dev_type()
-        self.devices = self.get_dev()
+        self._attrs = {}
+        self._config = None
+        self._driver = self._dev_name = self._sub_name = None
+        self._modules = self._dev_type = self._devices = None
+        if not lazy:
+            self.load()
+
+    def load(self):
+        for k in self.attr_keys:
+            self.__getitem__(k)
+        for prop in ('driver', 'dev_name', 'sub_name', 'modules', 'dev_type', 'devices'):
+            getattr(self, prop)
+        return self
+
+    def __getitem__(self, item):
+        if item not in self._attrs:
+            if item not in self.attr_keys:
+                raise KeyError(item)
+            if item in CONFIG_KEYS and self._config is None:
+                self.read_config()
+                if item in self._attrs:
+                    return self._attrs[item]
+            self._attrs[item] = self.read_attr(item)
+        return self._attrs[item]
+
+    def __contains__(self, item):
+        return item in self.attr_keys
+
+    def get(self, item, default=None):
+        if item not in self.attr_keys:
+            return default
+        return self.__getitem__(item)
+
+    def __iter__(self):
+        return iter(self.attr_keys)
+
+    def __len__(self):
+        return self.attr_keys.__len__()
+
+    def keys(self):
+        return self.attr_keys
+
+    def values(self):
+        return [self.__getitem__(k) for k in self.attr_keys]
+
+    def items(self):
+        return [(k, self.__getitem__(k)) for k in self.attr_keys]
+
+    @property
+    def data(self):
+        return {k: self.__getitem__(k) for k in self.attr_keys}
 
     def __getattr__(self, item):
+        if item.startswith('_'):
+            raise AttributeError(item)
         return self.get(item, '')
 
+    @property
+    def info(self):
+        return PCIInfo()
+
+    @property
+    def driver(self):
+        if self._driver is None:
+            self._driver = self.read_driver()
+        return self._driver
+
+    @property
+    def dev_name(self):
+        if self._dev_name is None:
+            self._dev_name = ' '.join(self.info.find(self.vendor[2:],
+                                                     self.device[2:],
+                                                     self.subsystem_vendor[2:],
+                                                     self.subsystem_device[2:])
+                                      )
+        return self._dev_name
+
+    @property
+    def sub_name(self):
+        if self._sub_name is None:
+            self._sub_name = ' '.join(self.info.find(self.subsystem_vendor[2:],
+                                                     self.subsystem_device[2:])
+                                      )
+        return self._sub_name
+
+    @property
+    def modules(self):
+        if self._modules is None:
+            self._modules = ModuleAlias().find(self.modalias)
+        return self._modules
+
+    @property
+    def dev_type_name(self):
+        return self.dev_type_info[0]
+
+    @property
+    def dev_type(self):
+        return self.dev_type_info[1]
+
+    @property
+    def dev_type_info(self):
+        if self._dev_type is None:
+            self._dev_type = self.get_dev_type()
+        return self._dev_type
+
+    @property
+    def devices(self):
+        if self._devices is None:
+            self._devices = self.get_dev()
+        return self._devices
+
     def get_dev(self):
         dev_pats = {
             '01': ['ata[0-9]/host[0-9]/target[0-9]:[0-9]:[0-9]/[0-9]:[0-9]:[0-9]:[0-9]/block/*'],
@@ -245,6 +552,135 @@ class PCIDevice(UserDict):
             return os.path.basename(os.readlink(driver_path))
         return ''
 
+    def read_config(self) -> bytes:
+        """
+        decode the ids in CONFIG_KEYS from a single pread of the config space,
+        anything that can not be decoded is left to read_attr
+        """
+        if self._config is not None:
+            return self._config
+        try:
+            fd = os.open(os.path.join(self.dev_path, 'config'), os.O_RDONLY)
+            try:
+                self._config = os.pread(fd, 256, 0)
+            finally:
+                os.close(fd)
+        except OSError:
+            self._config = b''
+        config = self._config
+        if config.__len__() < 64:
+            return config
+        vendor, device, _, _, revision, prog_if, sub_class, base_class, _, _, header_type, _ = \
+            CONFIG_HEADER.unpack_from(config)
+        if vendor == 0xffff:
+            return config
+        attrs = {'vendor': '0x{:04x}'.format(vendor),
+                 'device': '0x{:04x}'.format(device),
+                 'revision': '0x{:02x}'.format(revision),
+                 'class': '0x{:02x}{:02x}{:02x}'.format(base_class, sub_class, prog_if)}
+        if header_type & 0x7f == 0:
+            sub_vendor, sub_device = struct.unpack_from('<HH', config, 0x2c)
+            attrs['subsystem_vendor'] = '0x{:04x}'.format(sub_vendor)
+            attrs['subsystem_device'] = '0x{:04x}'.format(sub_device)
+        link = self.parse_link(config)
+        if link:
+            attrs['max_link_speed'] = PCIE_SPEED.get(link['max_speed'], 'Unknown')
+            attrs['max_link_width'] = str(link['max_width'])
+            attrs['current_link_speed'] = PCIE_SPEED.get(link['current_speed'], 'Unknown')
+            attrs['current_link_width'] = str(link['current_width'])
+        for k, v in attrs.items():
+            self._attrs.setdefault(k, v)
+        return config
+
+    @staticmethod
+    def find_capability(config: bytes, cap_id: int) -> int:
+        """
+        walk the capability list, return the offset of cap_id or 0
+        """
+        status, = struct.unpack_from('<H', config, 0x06)
+        if not status & PCI_STATUS_CAP_LIST:
+            return 0
+        pos = config[PCI_CAPABILITY_LIST] & 0xfc
+        # at most 48 capabilities fit in 256 bytes, guards against loops
+        for _ in range(48):
+            if pos < 0x40 or pos + 2 > config.__len__():
+                break
+            if config[pos] == cap_id:
+                return pos
+            pos = config[pos + 1] & 0xfc
+        return 0
+
+    @staticmethod
+    def parse_link(config: bytes) -> dict:
+        """
+        PCIe link capability and status from the express capability,
+        empty unless the config space was readable past the header (root)
+        """
+        pos = PCIDevice.find_capability(config, PCI_CAP_ID_EXP)
+        if not pos or pos + PCI_EXP_LNKSTA + 2 > config.__len__():
+            return {}
+        link_cap, = struct.unpack_from('<I', config, pos + PCI_EXP_LNKCAP)
+        link_status, = struct.unpack_from('<H', config, pos + PCI_EXP_LNKSTA)
+        return {'max_speed': link_cap & 0xf,
+                'max_width': (link_cap >> 4) & 0x3f,
+                'current_speed': link_status & 0xf,
+                'current_width': (link_status >> 4) & 0x3f}
+
+    def upstream(self, devices=None):
+        """
+        bridges between this device and the root complex, nearest first,
+        devices maps bdf to already built PCIDevice objects
+        """
+        devices = devices or {}
+        bridges = []
+        path = os.path.dirname(os.path.realpath(self.dev_path))
+        while BDF.match(os.path.basename(path)):
+            bdf = os.path.basename(path)
+            bridge = devices.get(bdf)
+            if bridge is None:
+                bridge = PCIDevice(os.path.join('/sys/bus/pci/devices', bdf), lazy=True)
+            bridges.append(bridge)
+            path = os.path.dirname(path)
+        return bridges
+
+    @property
+    def local_cpu_set(self) -> set:
+        return cpu_mask_parse(self.local_cpus)
+
+    @property
+    def msi_irqs(self) -> list:
+        try:
+            return sorted(int(irq) for irq in os.listdir(os.path.join(self.dev_path, 'msi_irqs')))
+        except (OSError, ValueError):
+            return []
+
+    @property
+    def msi_vectors(self) -> list:
+        """
+        [(irq, 'msi' or 'msix'), ...]
+        """
+        vectors = []
+        for irq in self.msi_irqs:
+            vectors.append((irq, self.read_attr(str(irq), os.path.join(self.dev_path, 'msi_irqs'))))
+        return vectors
+
+    def power_states(self) -> dict:
+        """
+        enabled ASPM link states, runtime PM control and D3cold, d3cold_allowed
+        defaults to 1 and only matters when runtime PM can suspend the device
+        """
+        link_path = os.path.join(self.dev_path, 'link')
+        runtime_pm = self.read_attr('control', os.path.join(self.dev_path, 'power')) == 'auto'
+        return {
+            'aspm': [state for state in PCIE_ASPM if self.read_attr(state, link_path) == '1'],
+            'runtime_pm': runtime_pm,
+            'd3cold': runtime_pm and self.read_attr('d3cold_allowed') == '1',
+        }
+
+    @property
+    def link_status(self):
+        return self.parse_link(self.read_config())
+
     def read_attr(self, name: str, path=None):
         if path is None:
             path = os.path.join(self.dev_path, name)
@@ -289,13 +725,427 @@ class PCIDevice(UserDict):
                     self.modules)
 
 
+def pci_paths(prefix='/sys/bus/pci/devices'):
+    """
+    device paths sorted by domain:bus:device.function
+    """
+    return sorted(os.path.join(prefix, name) for name in os.listdir(prefix))
+
+
+def iter_pci(workers=8, lazy=False, prefix='/sys/bus/pci/devices'):
+    """
+    yield PCIDevice objects in BDF order as they are built on a thread pool,
+    the sysfs reads release the GIL so their latency overlaps; only a window of
+    2 * workers devices is queued, so stopping early leaves no backlog behind
+    """
+    paths = pci_paths(prefix)
+    # build the shared tables before any worker can race on them
+    PCIInfo()
+    ModuleAlias()
+    if workers <= 1:
+        for path in paths:
+            yield PCIDevice(path, lazy)
+        return
+    paths = iter(paths)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque(executor.submit(PCIDevice, path, lazy) for path in itertools.islice(paths, workers * 2))
+    try:
+        while pending:
+            dev = pending.popleft().result()
+            for path in itertools.islice(paths, 1):
+                pending.append(executor.submit(PCIDevice, path, lazy))
+            yield dev
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def scan_pci(workers=8, lazy=False, prefix='/sys/bus/pci/devices'):
+    return list(iter_pci(workers, lazy, prefix))
+
+
+def link_speed(speed: str) -> float:
+    """
+    '8.0 GT/s PCIe' -> 8.0, 0.0 for 'Unknown' or a missing link
+    """
+    try:
+        return float(speed.split()[0])
+    except (ValueError, IndexError):
+        return 0.0
+
+
+def link_bandwidth(speed: str, width: str) -> float:
+    """
+    usable GB/s of a link, 8b/10b coding up to 5 GT/s and 128b/130b above
+    """
+    gts = link_speed(speed)
+    try:
+        lanes = int(width)
+    except ValueError:
+        return 0.0
+    encoding = 0.8 if gts <= 5.0 else 128 / 130
+    return gts * encoding * lanes / 8
+
+
+def link_report(devices=None):
+    """
+    compare negotiated with maximum speed and width of every PCIe device and
+    each upstream bridge, the bottleneck is the hop with the least bandwidth
+    """
+    if devices is None:
+        devices = scan_pci(lazy=True)
+    by_bdf = {os.path.basename(dev.dev_path): dev for dev in devices}
+    report = []
+    for dev in devices:
+        if not dev.max_link_speed:
+            continue
+        hops = []
+        for hop in [dev] + dev.upstream(by_bdf):
+            if not hop.max_link_speed:
+                continue
+            hops.append({
+                'device': os.path.basename(hop.dev_path),
+                'current_speed': link_speed(hop.current_link_speed),
+                'max_speed': link_speed(hop.max_link_speed),
+                'current_width': hop.current_link_width,
+                'max_width': hop.max_link_width,
+                'bandwidth': link_bandwidth(hop.current_link_speed, hop.current_link_width),
+                'max_bandwidth': link_bandwidth(hop.max_link_speed, hop.max_link_width),
+            })
+        own = hops[0]
+        bottleneck = min(hops, key=lambda hop: hop['bandwidth'])
+        report.append(dict(own,
+                           name=dev.dev_name,
+                           degraded=own['bandwidth'] < own['max_bandwidth'],
+                           bottleneck=bottleneck['device'],
+                           path_bandwidth=bottleneck['bandwidth'],
+                           path_degraded=bottleneck['bandwidth'] < own['max_bandwidth'],
+                           path=hops))
+    return report
+
+
+def print_link_report(devices=None):
+    for entry in link_report(devices):
+        flag = 'DEGRADED' if entry['degraded'] else 'LIMITED' if entry['path_degraded'] else 'ok'
+        print('{:<8} {} {} GT/s x{} (max {} GT/s x{}) {:.2f}/{:.2f} GB/s bottleneck {} {}'.format(
+            flag,
+            entry['device'],
+            entry['current_speed'],
+            entry['current_width'],
+            entry['max_speed'],
+            entry['max_width'],
+            entry['path_bandwidth'],
+            entry['max_bandwidth'],
+            entry['bottleneck'],
+            entry['name']))
+
+
+def cpu_mask_parse(mask: str) -> set:
+    """
+    '00000000,0000ff00' -> {8, ..., 15}
+    """
+    try:
+        bits = int(mask.replace(',', ''), 16)
+    except ValueError:
+        return set()
+    cpus = set()
+    cpu = 0
+    while bits:
+        if bits & 1:
+            cpus.add(cpu)
+        bits >>= 1
+        cpu += 1
+    return cpus
+
+
+def cpu_list_parse(cpu_list: str) -> set:
+    """
+    '0-3,8' -> {0, 1, 2, 3, 8}
+    """
+    cpus = set()
+    for part in cpu_list.strip().split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def numa_nodes(prefix='/sys/devices/system/node'):
+    """
+    {node: cpu set} from the sysfs node directories
+    """
+    nodes = {}
+    for path in glob.glob(os.path.join(prefix, 'node[0-9]*')):
+        try:
+            with open(os.path.join(path, 'cpulist'))as fp:
+                nodes[int(os.path.basename(path)[4:])] = cpu_list_parse(fp.read())
+        except (OSError, ValueError):
+            continue
+    return nodes
+
+
+def irq_affinity(irq, prefix='/proc/irq') -> set:
+    """
+    CPUs an irq is currently routed to, effective_affinity_list is what the
+    interrupt chip applied, smp_affinity_list the request on older kernels
+    """
+    for name in ('effective_affinity_list', 'smp_affinity_list'):
+        try:
+            with open(os.path.join(prefix, str(irq), name))as fp:
+                return cpu_list_parse(fp.read())
+        except (OSError, ValueError):
+            continue
+    return set()
+
+
+def numa_report(devices=None, irq_prefix='/proc/irq'):
+    """
+    NICs, storage controllers, GPUs and accelerators grouped by NUMA node, with
+    the CPUs each device's interrupts are routed to now
+    """
+    if devices is None:
+        devices = scan_pci(lazy=True)
+    nodes = numa_nodes()
+    report = {}
+    for dev in devices:
+        if not set(dev.dev_type) & {'01', '02', '03', '12'}:
+            continue
+        try:
+            node = int(dev.numa_node)
+        except ValueError:
+            node = -1
+        local = dev.local_cpu_set or nodes.get(node, set())
+        irqs = dev.msi_irqs
+        if not irqs and dev.irq not in ('', '0'):
+            irqs = [int(dev.irq)]
+        serviced = set()
+        for irq in irqs:
+            serviced.update(irq_affinity(irq, irq_prefix))
+        remote = serviced - local if local else set()
+        report.setdefault(node, []).append({
+            'device': os.path.basename(dev.dev_path),
+            'type': ', '.join(dev.dev_type_name),
+            'name': dev.dev_name,
+            'driver': dev.driver,
+            'local_cpus': sorted(local),
+            'irqs': irqs,
+            'irq_cpus': sorted(serviced),
+            'remote_irq_cpus': sorted(remote),
+            'local': not remote,
+        })
+    return report
+
+
+def print_numa_report(devices=None):
+    for node, entries in sorted(numa_report(devices).items()):
+        print('node {}'.format(node))
+        for entry in entries:
+            print('\t{} {} [{}] {} irqs: {} cpus: {}{}'.format(
+                entry['device'],
+                entry['type'],
+                entry['driver'],
+                entry['name'],
+                entry['irqs'].__len__(),
+                entry['irq_cpus'],
+                '' if entry['local'] else ' REMOTE: {}'.format(entry['remote_irq_cpus'])))
+
+
+class InterruptSampler:
+    """
+    samples /proc/interrupts into a flat (irq x cpu) counter matrix, each
+    sample after the first keeps the counter deltas for per-vector, per-CPU
+    rates; the matrix is row major, row = irq, column = cpu
+    """
+    def __init__(self, path='/proc/interrupts'):
+        self.path = path
+        self.irqs = {}
+        # irq label -> row
+        self.cpus = 0
+        self.counts = None
+        self.deltas = []
+        self.interval = 0.0
+        self.timestamp = None
+
+    def read(self):
+        with open(self.path)as fp:
+            lines = fp.read().splitlines()
+        cpus = lines[0].split().__len__()
+        irqs = {}
+        counts = []
+        for line in lines[1:]:
+            fields = line.split(None, cpus + 1)
+            if not fields:
+                continue
+            if fields.__len__() > cpus and fields[cpus].isdigit():
+                counts.extend(map(int, fields[1:cpus + 1]))
+            else:
+                # 'ERR:' and friends carry fewer columns
+                row = []
+                for v in fields[1:cpus + 1]:
+                    if not v.isdigit():
+                        break
+                    row.append(int(v))
+                counts.extend(row + [0] * (cpus - row.__len__()))
+            irqs[fields[0].rstrip(':')] = irqs.__len__()
+        return irqs, cpus, counts
+
+    def sample(self):
+        now = time.monotonic()
+        irqs, cpus, counts = self.read()
+        deltas = [0] * counts.__len__()
+        if self.counts is not None and cpus == self.cpus:
+            if irqs.keys() == self.irqs.keys():
+                deltas = self.delta(counts, self.counts)
+            else:
+                for irq, row in irqs.items():
+                    old_row = self.irqs.get(irq)
+                    if old_row is None:
+                        continue
+                    new, old = row * cpus, old_row * cpus
+                    deltas[new:new + cpus] = self.delta(counts[new:new + cpus], self.counts[old:old + cpus])
+            self.interval = now - self.timestamp
+        self.irqs, self.cpus, self.counts, self.deltas, self.timestamp = irqs, cpus, counts, deltas, now
+        return self
+
+    @staticmethod
+    def delta(counts, old_counts):
+        deltas = list(map(operator.sub, counts, old_counts))
+        if deltas and min(deltas) < 0:
+            # per-cpu counters are unsigned int in the kernel and may wrap
+            deltas = [d & 0xffffffff for d in deltas]
+        return deltas
+
+    @property
+    def rates(self):
+        """
+        the whole (irq x cpu) matrix in interrupts/s
+        """
+        if not self.interval:
+            return array('d', bytes(8 * self.deltas.__len__()))
+        return array('d', map(operator.truediv, self.deltas, itertools.repeat(self.interval)))
+
+    def rate(self, irq):
+        """
+        per-CPU interrupts/s of one irq from the last sample
+        """
+        row = self.irqs.get(str(irq))
+        if row is None or not self.interval:
+            return array('d', bytes(8 * self.cpus))
+        return array('d', [d / self.interval for d in self.deltas[row * self.cpus:(row + 1) * self.cpus]])
+
+    def hot_spots(self, devices, share=0.8):
+        """
+        devices whose MSI/MSI-X vectors mostly land on a single CPU
+        """
+        spots = []
+        if self.cpus < 2:
+            return spots
+        for dev in devices:
+            vectors = dev.msi_irqs
+            if vectors.__len__() < 2:
+                continue
+            per_cpu = array('d', bytes(8 * self.cpus))
+            for irq in vectors:
+                for cpu, value in enumerate(self.rate(irq)):
+                    per_cpu[cpu] += value
+            total = sum(per_cpu)
+            if not total:
+                continue
+            top = max(range(self.cpus), key=per_cpu.__getitem__)
+            if per_cpu[top] / total >= share:
+                spots.append({'device': os.path.basename(dev.dev_path),
+                              'driver': dev.driver,
+                              'vectors': vectors.__len__(),
+                              'cpu': top,
+                              'share': per_cpu[top] / total,
+                              'rate': total})
+        return spots
+
+
+def print_irq_hot_spots(interval=1.0, devices=None):
+    if devices is None:
+        devices = scan_pci(lazy=True)
+    sampler = InterruptSampler()
+    sampler.sample()
+    time.sleep(interval)
+    sampler.sample()
+    for spot in sampler.hot_spots(devices):
+        print('{} [{}] {} vectors: {:.0%} of {:.0f} irq/s on cpu{}'.format(
+            spot['device'],
+            spot['driver'],
+            spot['vectors'],
+            spot['share'],
+            spot['rate'],
+            spot['cpu']))
+
+
+def power_audit(devices=None):
+    """
+    power saving states enabled on every device and along its bridge path,
+    latency critical devices are flagged for ASPM on any hop or runtime PM on
+    the device itself: a bridge only suspends once everything below it is idle
+    """
+    if devices is None:
+        devices = scan_pci(lazy=True)
+    by_bdf = {os.path.basename(dev.dev_path): dev for dev in devices}
+    states = {}
+    report = []
+    for dev in devices:
+        path = []
+        for hop in [dev] + dev.upstream(by_bdf):
+            bdf = os.path.basename(hop.dev_path)
+            if bdf not in states:
+                states[bdf] = hop.power_states()
+            path.append(dict(states[bdf], device=bdf))
+        own = path[0]
+        deep = own['runtime_pm'] or any(hop['aspm'] for hop in path)
+        report.append(dict(own,
+                           name=dev.dev_name,
+                           type=', '.join(dev.dev_type_name),
+                           path=path,
+                           flagged=deep and bool(set(dev.dev_type) & set(LATENCY_CRITICAL))))
+    return report
+
+
+def print_power_audit(devices=None):
+    for entry in power_audit(devices):
+        enabled = []
+        for own, hop in zip(itertools.chain([True], itertools.repeat(False)), entry['path']):
+            # bridge runtime PM does not delay the device, see power_audit
+            hop_states = hop['aspm'] + [name for name in ('runtime_pm', 'd3cold') if own and hop[name]]
+            if hop_states:
+                enabled.append('{}: {}'.format(hop['device'], ','.join(hop_states)))
+        print('{:<8} {} {} {}{}'.format(
+            'LATENCY' if entry['flagged'] else 'ok',
+            entry['device'],
+            entry['type'],
+            entry['name'],
+            ''.join('\n\t' + hop for hop in enabled)))
+
+
 def find_pci():
-    pci_devices = glob.glob('/sys/bus/pci/devices/*')
+    pci_devices = scan_pci()
     print(pci_devices.__len__())
-    for pci_path in pci_devices:
-        pci = PCIDevice(pci_path)
+    for pci in pci_devices:
         print(pci)
 
 
 if __name__ == '__main__':
-    find_pci()
+    try:
+        arg = sys.argv[1]
+    except IndexError:
+        arg = None
+    if arg == '-l':
+        print_link_report()
+    elif arg == '-n':
+        print_numa_report()
+    elif arg == '-i':
+        print_irq_hot_spots()
+    elif arg == '-p':
+        print_power_audit()
+    elif arg == '-h':
+        print('Usage:\n\t-l  PCIe link health\n\t-n  NUMA locality\n\t-i  interrupt hot spots\n\t-p  power saving audit\n\t-h  show this')
+    else:
+        find_pci()
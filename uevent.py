@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+import errno
+import os
+import socket
+import sys
+from pci import PCIDevice, scan_pci
+from usb import SysfsIndex, USBDevice, find_usb
+from blk import BlockDevice, scan_blk
+
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+UEVENT_BUFFER_SIZE = 64 * 1024
+# room for a hotplug burst, a storage shelf announces hundreds of devices at once
+UEVENT_RCVBUF = 8 * 1024 * 1024
+
+
+def parse_uevent(message: bytes) -> dict:
+    """
+    b'add@/devices/...\\0ACTION=add\\0DEVPATH=/devices/...\\0SUBSYSTEM=pci\\0...'
+    -> {'ACTION': 'add', 'DEVPATH': '/devices/...', 'SUBSYSTEM': 'pci', ...}
+    """
+    event = {}
+    for field in message.split(b'\0'):
+        key, sep, value = field.partition(b'=')
+        if sep:
+            event[key.decode(errors='replace')] = value.decode(errors='replace')
+    return event
+
+
+class UeventSocket:
+    """
+    kernel uevents from a NETLINK_KOBJECT_UEVENT socket, iteration raises
+    OSError(ENOBUFS) when events were dropped
+    """
+    def __init__(self):
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        try:
+            # past net.core.rmem_max, needs CAP_NET_ADMIN
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUFFORCE, UEVENT_RCVBUF)
+        except (OSError, AttributeError):
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UEVENT_RCVBUF)
+        # port 0 lets the kernel pick a free one, the pid is taken by the first socket
+        self._sock.bind((0, UEVENT_KERNEL_GROUP))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._sock.close()
+
+    def __iter__(self):
+        while True:
+            message = self._sock.recv(UEVENT_BUFFER_SIZE)
+            # udev rebroadcasts start with 'libudev', only kernel events are wanted
+            if message.startswith(b'libudev'):
+                continue
+            event = parse_uevent(message)
+            if 'ACTION' in event:
+                yield event
+
+
+class UeventReplay:
+    """
+    recorded uevents, as printed by 'udevadm monitor --kernel --property':
+    blocks of KEY=VALUE lines separated by blank lines, other lines ignored
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        event = {}
+        with open(self.path)as fp:
+            for line in fp:
+                line = line.strip()
+                if not line:
+                    if 'ACTION' in event:
+                        yield event
+                    event = {}
+                    continue
+                key, sep, value = line.partition('=')
+                if sep:
+                    event[key] = value
+        if 'ACTION' in event:
+            yield event
+
+
+class Inventory:
+    """
+    PCIDevice, USBDevice and BlockDevice objects kept up to date from uevents,
+    only the device an event refers to is rebuilt
+    """
+    def __init__(self, scan=True):
+        self.devices = {'pci': {}, 'usb': {}, 'block': {}}
+        self.callbacks = {'add': [], 'remove': [], 'change': []}
+        if scan:
+            self.scan()
+
+    def scan(self):
+        self.devices['pci'] = {os.path.basename(dev.dev_path): dev for dev in scan_pci()}
+        self.devices['usb'] = {}
+        index = SysfsIndex()
+        for path in find_usb():
+            self._update('usb', os.path.basename(path), index=index)
+        self.devices['block'] = {dev.dev_name: dev for dev in scan_blk()}
+
+    def on(self, action, callback):
+        """
+        callback(kind, key, device) for 'add', 'remove' or 'change'
+        """
+        self.callbacks[action].append(callback)
+
+    @staticmethod
+    def device_key(event):
+        """
+        (kind, key) of the inventory entry an event belongs to, None if untracked
+        """
+        subsystem = event.get('SUBSYSTEM')
+        dev_path = event.get('DEVPATH', '')
+        name = os.path.basename(dev_path)
+        if subsystem == 'pci':
+            return 'pci', name
+        if subsystem == 'usb':
+            if event.get('DEVTYPE') == 'usb_interface':
+                # an interface change rebuilds the device that owns it
+                return 'usb', os.path.basename(os.path.dirname(dev_path))
+            return 'usb', name
+        if subsystem == 'block':
+            if event.get('DEVTYPE') == 'partition':
+                return 'block', os.path.basename(os.path.dirname(dev_path))
+            return 'block', name
+        return None
+
+    @staticmethod
+    def build(kind, key, index=None):
+        """
+        index: SysfsIndex shared by the USB devices of one scan, a fresh one
+        is read otherwise so hot-plugged devices find their tty/net/block names
+        """
+        if kind == 'pci':
+            return PCIDevice(os.path.join('/sys/bus/pci/devices', key))
+        if kind == 'usb':
+            return USBDevice(os.path.join('/sys/bus/usb/devices', key), index=index or SysfsIndex())
+        return BlockDevice(os.path.join('/sys/block', key))
+
+    def _update(self, kind, key, index=None):
+        try:
+            device = self.build(kind, key, index)
+        except (OSError, ValueError):
+            # gone again before it could be read
+            return None
+        self.devices[kind][key] = device
+        return device
+
+    def _notify(self, action, kind, key, device):
+        for callback in self.callbacks[action]:
+            callback(kind, key, device)
+
+    def handle(self, event):
+        target = self.device_key(event)
+        if target is None:
+            return
+        kind, key = target
+        action = event.get('ACTION')
+        whole_device = key == os.path.basename(event.get('DEVPATH', ''))
+        if action == 'remove' and whole_device:
+            device = self.devices[kind].pop(key, None)
+            if device is not None:
+                self._notify('remove', kind, key, device)
+        elif action in ('add', 'remove', 'change', 'bind', 'unbind', 'move'):
+            known = key in self.devices[kind]
+            device = self._update(kind, key)
+            if device is not None:
+                self._notify('change' if known else 'add', kind, key, device)
+
+    def resync(self):
+        """
+        rescan after events were lost, add and remove are reported for the
+        difference, changes in between cannot be told apart
+        """
+        before = {kind: dict(devices) for kind, devices in self.devices.items()}
+        self.scan()
+        for kind, devices in self.devices.items():
+            for key in devices.keys() - before[kind].keys():
+                self._notify('add', kind, key, devices[key])
+            for key in before[kind].keys() - devices.keys():
+                self._notify('remove', kind, key, before[kind][key])
+
+    def watch(self, source=None):
+        """
+        apply events from source (a UeventSocket by default) until it ends
+        """
+        if source is None:
+            source = UeventSocket()
+        while True:
+            try:
+                for event in source:
+                    self.handle(event)
+                return
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                self.resync()
+
+
+if __name__ == '__main__':
+    inventory = Inventory()
+    for action in ('add', 'remove', 'change'):
+        inventory.on(action, lambda kind, key, device, action=action: print(action, kind, key))
+    try:
+        replay = sys.argv[1]
+    except IndexError:
+        replay = None
+    try:
+        inventory.watch(UeventReplay(replay) if replay else None)
+    except KeyboardInterrupt:
+        pass
@@ -1,12 +1,19 @@
 #!/usr/bin/python3
 import glob
-import pprint
 from collections import UserDict
 import os
+import re
+import mmap
 import sys
+import time
+from json import JSONEncoder
+from pci import IdsCache
 
 
 class USBInfo:
+    """
+    usb.ids lookups served from an IdsCache, tables: vendor, product, class
+    """
     modes = type('usb_ids',
                  (),
                  dict(zip(('Vendor', 'Class', 'Misc'), range(3)))
@@ -18,81 +25,95 @@ class USBInfo:
         "/usr/share/kcmusb/usb.ids",
         '/var/lib/usbutils/usb.ids'
     ]
-    usb_vendors = {}
-    usb_products = {}
-    usb_classes = {}
+    VENDOR, PRODUCT, CLASS = range(3)
+    # keep a compiled usb.ids under the cache dir, invalidated by mtime/size
+    persist = True
+    hex4 = re.compile(rb'[0-9a-f]{4}')
+    hex2 = re.compile(rb'[0-9a-f]{2}')
+    _cache = None
     _instance = None
 
     def __new__(cls, *args, **kwargs):
         if not getattr(cls, '_instance'):
             cls._instance = super(USBInfo, cls).__new__(cls, *args, **kwargs)
-            cls.parse_usb_ids()
+            cls._init()
         return cls._instance
 
     @staticmethod
-    def open_read_ign(fn):
-        try:
-            return open(fn, 'r', errors='ignore')
-        except IOError:
-            return open(fn, 'r')
+    def _init():
+        USBInfo._cache = None
+        for unm in USBInfo.usbids:
+            if os.path.exists(unm):
+                USBInfo._cache = IdsCache(unm, b'USBIDS01', USBInfo.parse_usb_ids, USBInfo.persist)
+                break
 
     @staticmethod
-    def is_hex_digit(string):
-        for dg in string:
-            if not dg.isdigit() and dg not in 'abcdef':
-                return False
-        return True
+    def class_key(cid, sid, pid):
+        # -1 means "any" in usb.ids, shift every part by one to keep keys unsigned
+        return (cid + 1) << 18 | (sid + 1) << 9 | (pid + 1)
 
     @staticmethod
-    def parse_usb_ids():
+    def parse_usb_ids(unm):
+        """
+        one pass over the memory-mapped usb.ids
+        """
+        usb_vendors, usb_products, usb_classes = {}, {}, {}
         vid = 0
         did = 0
+        cid = 0
         mode = USBInfo.modes.Vendor
-        c_str = ""
-        for unm in USBInfo.usbids:
-            if os.path.exists(unm):
-                break
-        for ln in USBInfo.open_read_ign(unm).readlines():
-            if ln[0] == '#':
-                continue
-            ln = ln.rstrip('\n')
-            if len(ln) == 0:
-                continue
-            if USBInfo.is_hex_digit(ln[0:4]):
-                mode = USBInfo.modes.Vendor
-                vid = int(ln[:4], 16)
-                USBInfo.usb_vendors[vid] = ln[6:]
-                continue
-            if ln[0] == '\t' and USBInfo.is_hex_digit(ln[1:3]):
-                # usb.ids has a.stat device id of 01xy, sigh
-                if ln[3:5] == "xy":
-                    did = int(ln[1:3], 16) * 256
-                else:
-                    did = int(ln[1:5], 16)
-                # USB devices
-                if mode == USBInfo.modes.Vendor:
-                    USBInfo.usb_products[vid, did] = ln[7:]
+        c_str = b""
+        if not os.path.getsize(unm):
+            return usb_vendors, usb_products, usb_classes
+        with open(unm, 'rb')as fp:
+            buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        with buf:
+            for ln in iter(buf.readline, b''):
+                ln = ln.rstrip(b'\r\n')
+                if not ln or ln[:1] == b'#':
                     continue
-                elif mode == USBInfo.modes.Class:
-                    nm = ln[5:]
-                    if nm != "Unused":
-                        str_g = c_str + ":" + nm
+                if USBInfo.hex4.match(ln):
+                    mode = USBInfo.modes.Vendor
+                    vid = int(ln[:4], 16)
+                    usb_vendors[vid] = ln[6:]
+                    continue
+                if ln[:1] == b'\t' and USBInfo.hex2.match(ln, 1):
+                    # usb.ids has a device id of 01xy, sigh
+                    if ln[3:5] == b"xy":
+                        did = int(ln[1:3], 16) * 256
                     else:
-                        str_g = c_str + ":"
-                    USBInfo.usb_classes[vid, did, -1] = str_g
+                        did = int(ln[1:5], 16)
+                    # USB devices
+                    if mode == USBInfo.modes.Vendor:
+                        usb_products[vid << 16 | did] = ln[7:]
+                        continue
+                    elif mode == USBInfo.modes.Class:
+                        nm = ln[5:]
+                        if nm != b"Unused":
+                            str_g = c_str + b":" + nm
+                        else:
+                            str_g = c_str + b":"
+                        usb_classes[USBInfo.class_key(cid, did, -1)] = str_g
+                        continue
+                if ln[:1] == b'C':
+                    mode = USBInfo.modes.Class
+                    cid = int(ln[2:4], 16)
+                    c_str = ln[6:]
+                    usb_classes[USBInfo.class_key(cid, -1, -1)] = c_str
                     continue
-            if ln[0] == 'C':
-                mode = USBInfo.modes.Class
-                cid = int(ln[2:4], 16)
-                c_str = ln[6:]
-                USBInfo.usb_classes[cid, -1, -1] = c_str
-                continue
-            if mode == USBInfo.modes.Class and ln[0] == '\t' and ln[1] == '\t' and USBInfo.is_hex_digit(ln[2:4]):
-                prid = int(ln[2:4], 16)
-                USBInfo.usb_classes[cid, did, prid] = ln[6:]
-                continue
-            mode = USBInfo.modes.Misc
-        USBInfo.usb_classes[0xFF, 0xFF, 0xFF] = "Vendor Specific"
+                if mode == USBInfo.modes.Class and ln[:2] == b'\t\t' and USBInfo.hex2.match(ln, 2):
+                    prid = int(ln[2:4], 16)
+                    usb_classes[USBInfo.class_key(cid, did, prid)] = ln[6:]
+                    continue
+                mode = USBInfo.modes.Misc
+        usb_classes[USBInfo.class_key(0xFF, 0xFF, 0xFF)] = b"Vendor Specific"
+        return usb_vendors, usb_products, usb_classes
+
+    @staticmethod
+    def search(table, key):
+        if USBInfo()._cache is None:
+            return ''
+        return USBInfo._cache.search(table, key)
 
     @staticmethod
     def find_usb_class(cid, sid, pid):
@@ -100,60 +121,64 @@ class USBInfo:
         Return USB protocol from usbclasses list
         lnlst = len(USBInfo.usbclasses)
         """
-        cls = USBInfo.usb_classes.get((cid, sid, pid)) \
-              or USBInfo.usb_classes.get((cid, sid, -1)) \
-              or USBInfo.usb_classes.get((cid, -1, -1))
-        if cls:
-            return str(cls)
-        return ""
+        return USBInfo.search(USBInfo.CLASS, USBInfo.class_key(cid, sid, pid)) \
+            or USBInfo.search(USBInfo.CLASS, USBInfo.class_key(cid, sid, -1)) \
+            or USBInfo.search(USBInfo.CLASS, USBInfo.class_key(cid, -1, -1))
 
     @staticmethod
-    def find_storage(hostno):
+    def find_storage(hostno, index=None):
         """
         Return SCSI block dev names for host
         """
-        res = ""
-        for ent in os.listdir("/sys/class/scsi_device/"):
-            (host, bus, tgt, lun) = ent.split(":")
-            if host == hostno:
-                try:
-                    for ent2 in os.listdir("/sys/class/scsi_device/%s/device/block" % ent):
-                        res += ent2 + " "
-                except FileNotFoundError:
-                    pass
-        return res
+        index = index or USBInfo.sysfs_index()
+        return ''.join(blk + ' ' for blk in index.storage.get(hostno, ()))
 
     @staticmethod
-    def add_drv(path, drv_nm):
-        res = ""
-        try:
-            for e2 in os.listdir(os.path.join(path, drv_nm)):
-                if e2[0:len(drv_nm)] == drv_nm:
-                    res += e2 + ' '
+    def add_drv(path, drv_nm, entries=None):
+        """
+        entries of drv_nm below the hid device at path, followed by its driver,
+        entries default to a listing of path/drv_nm
+        """
+        if entries is None:
             try:
-                if res:
-                    res += os.path.basename(os.readlink(os.path.join(path, 'driver')))
-            except (FileNotFoundError, OSError):
-                pass
+                entries = os.listdir(os.path.join(path, drv_nm))
+            except OSError:
+                entries = []
+        res = ''.join(e2 + ' ' for e2 in entries if e2[0:len(drv_nm)] == drv_nm)
+        try:
+            if res:
+                res += os.path.basename(os.readlink(os.path.join(path, 'driver')))
         except (FileNotFoundError, OSError):
             pass
         return res
 
+    @staticmethod
+    def sysfs_index():
+        """
+        a fresh index for lookups that were not handed one, devices come and go
+        so it is never kept
+        """
+        return SysfsIndex()
+
     @staticmethod
     def find_usb_prod(vid, pid):
         """Return device name from USB Vendor:Product list"""
-        vendor = USBInfo.usb_vendors.get(vid)
-        if vendor:
-            str_g = str(vendor)
-        else:
+        try:
+            # sysfs ids arrive as '0x046d'
+            vid = int(vid, 16) if isinstance(vid, str) else vid
+            pid = int(pid, 16) if isinstance(pid, str) else pid
+        except ValueError:
             return ""
-        product = USBInfo.usb_products.get((vid, pid))
+        vendor = USBInfo.search(USBInfo.VENDOR, vid)
+        if not vendor:
+            return ""
+        product = USBInfo.search(USBInfo.PRODUCT, vid << 16 | pid)
         if product:
-            return str_g + " " + str(product)
-        return str_g
+            return vendor + " " + product
+        return vendor
 
     @staticmethod
-    def find_dev(driver, usb_name):
+    def find_dev(driver, usb_name, index=None):
         """
         Return pseudo devname that's driven by driver
         """
@@ -163,53 +188,88 @@ class USBInfo:
             'sound/card',  # snd-usb-audio
             'net/',  # cdc_ether, ...
             'input/input',  # usbhid
-            'usb:hiddev',  # usb hid
             'bluetooth/hci',  # btusb
             'ttyUSB',  # btusb
             'tty/',  # cdc_acm
-            'usb:lp',  # usblp
             'usb/lp',  # usblp
             'usb/',  # hiddev, usblp
+            'usbmisc/',  # hiddev, usblp
             'usbhid',  # hidraw
         ]
-        prefix = ""
+        index = index or USBInfo.sysfs_index()
+        children = index.children.get(os.path.basename(usb_name), {})
         res = ""
         for nm in dev_lst:
-            dir_nm = prefix + usb_name
             prep = ""
+            entries = children
             idx = nm.find('/')
             if idx != -1:
                 prep = nm[:idx + 1]
-                dir_nm += "/" + nm[:idx]
+                entries = children.get(nm[:idx], {})
                 nm = nm[idx + 1:]
             ln = len(nm)
-            try:
-                for ent in os.listdir(dir_nm):
-                    if ent[:ln] == nm:
-                        res += prep + ent + " "
-                        if nm == "host":
-                            res += "(" + USBInfo.find_storage(ent[ln:])[:-1] + ")"
-            except (FileNotFoundError, OSError):
-                pass
+            for ent in sorted(entries):
+                if ent[:ln] == nm:
+                    res += prep + ent + " "
+                    if nm == "host":
+                        res += "(" + USBInfo.find_storage(ent[ln:], index)[:-1] + ")"
         dev_info = [res]
         if driver == "usbhid":
-            pat = '[0-9A-F][0-9A-F][0-9A-F][0-9A-F]:' \
-                  '[0-9A-F][0-9A-F][0-9A-F][0-9A-F]:' \
-                  '[0-9A-F][0-9A-F][0-9A-F][0-9A-F].' \
-                  '[0-9A-F][0-9A-F][0-9A-F][0-9A-F]'
-            for ent in glob.glob(os.path.join(prefix + usb_name, pat)):
-                ent = os.path.split(ent)[-1]
-                dev_info.append(USBInfo.add_drv(os.path.join(prefix + usb_name, ent), "hidraw"))
-                add = USBInfo.add_drv(os.path.join(prefix + usb_name, ent), "input")
-                if add:
-                    dev_info.append(add)
-                else:
-                    for ent2 in glob.glob(os.path.join(prefix + usb_name, ent + pat)):
-                        ent2 = os.path.split(ent2)[-1]
-                        dev_info.append(USBInfo.add_drv(os.path.join(prefix + usb_name, ent, ent2), "input"))
+            for ent in sorted(children):
+                if not SysfsIndex.hid.match(ent):
+                    continue
+                hid_path = os.path.join(usb_name, ent)
+                dev_info.append(USBInfo.add_drv(hid_path, "hidraw", children[ent].get('hidraw', {})))
+                dev_info.append(USBInfo.add_drv(hid_path, "input", children[ent].get('input', {})))
         return ''.join(dev_info)
 
 
+class SysfsIndex:
+    """
+    one pass over the class directories a USB interface can own:
+        children: usb device or interface name -> nested dict of the
+                  relative path of every class device below it
+        storage:  scsi host number -> block devices
+    """
+    classes = ('tty', 'net', 'input', 'hidraw', 'video4linux', 'sound', 'bluetooth', 'usb', 'usbmisc', 'scsi_host')
+    usb_node = re.compile(r'^(usb\d+|\d+-[\d.]+(:\d+\.\d+)?)$')
+    scsi_device = re.compile(r'^\d+:\d+:\d+:\d+$')
+    hid = re.compile(r'^[0-9A-F]{4}:[0-9A-F]{4}:[0-9A-F]{4}\.[0-9A-F]{4}$')
+
+    def __init__(self, prefix='/sys/class'):
+        self.children = {}
+        self.storage = {}
+        for cls in self.classes:
+            for path in self._class_devices(os.path.join(prefix, cls)):
+                self._add_child(path)
+        for path in self._class_devices(os.path.join(prefix, 'block')):
+            parts = path.split('/')
+            # partitions live one level below their disk
+            if parts[-2] != 'block':
+                continue
+            for part in reversed(parts):
+                if self.scsi_device.match(part):
+                    self.storage.setdefault(part.split(':')[0], []).append(parts[-1])
+                    break
+
+    @staticmethod
+    def _class_devices(class_path):
+        try:
+            entries = list(os.scandir(class_path))
+        except FileNotFoundError:
+            return []
+        return [os.path.realpath(entry.path) for entry in entries]
+
+    def _add_child(self, path):
+        parts = path.split('/')
+        for i in range(parts.__len__() - 2, -1, -1):
+            if self.usb_node.match(parts[i]):
+                node = self.children.setdefault(parts[i], {})
+                for part in parts[i + 1:]:
+                    node = node.setdefault(part, {})
+                return
+
+
 class USBDevice(UserDict):
     usb_type = {
         '00': 'Device',
@@ -237,10 +297,11 @@ class USBDevice(UserDict):
         '-1': 'unk. '
     }
 
-    def __init__(self, dev_path: str, show_all=False, *args, **kwargs):
+    def __init__(self, dev_path: str, show_all=False, index=None, *args, **kwargs):
         super(USBDevice, self).__init__(*args, **kwargs)
         self._show_all = show_all
         self._u_info = USBInfo()
+        self._index = index or USBInfo.sysfs_index()
         self._path = dev_path
         self._device_attr()
 
@@ -283,7 +344,7 @@ class USBDevice(UserDict):
         new_name = self._u_info.find_usb_prod(self.idVendor, self.idProduct)
         if new_name:
             self.__setitem__('name', new_name)
-        dev_name = USBInfo.find_dev(self.driver, self._path)
+        dev_name = USBInfo.find_dev(self.driver, self._path, self._index)
         if not dev_name:
             dev_name = os.path.split(self._path)[-1]
         self.__setitem__('dev_name', dev_name)
@@ -292,8 +353,24 @@ class USBDevice(UserDict):
         self.__setitem__('bus_id', bus_id if bus_id else '-')
         self.__setitem__('dev_id', dev_id if dev_id else '-')
         self.__setitem__('endpoint', self._end_point_attr(os.path.join(self._path, 'ep_00')))
+        self.__setitem__('power', self._power_attr())
         self.get_interface()
 
+    def _power_attr(self) -> dict:
+        """
+        control: 'auto' lets the device autosuspend, 'on' keeps it active
+        autosuspend_delay_ms: idle time before suspending, negative disables it
+        runtime_status: active, suspended, ...
+        runtime_suspended_time: total ms spent runtime suspended
+        """
+        power_path = os.path.join(self._path, 'power')
+        return {
+            'control': self.read_attr('control', power_path),
+            'autosuspend_delay_ms': int(self.read_attr('autosuspend_delay_ms', power_path)),
+            'runtime_status': self.read_attr('runtime_status', power_path),
+            'runtime_suspended_time': int(self.read_attr('runtime_suspended_time', power_path)),
+        }
+
     def _get_end_point_attr(self, interface_path: str) -> list:
         end_point = []
         for end_point_path in glob.glob(os.path.join(interface_path, 'ep_*')):
@@ -312,12 +389,55 @@ class USBDevice(UserDict):
             'wMaxPacketSize': int(self.read_attr('wMaxPacketSize', end_point_path), 16)
         }
 
+    def _companion_attr(self) -> dict:
+        """
+        SuperSpeed endpoint companions of the active configuration from the raw
+        descriptors, {(interface, alt setting, bEndpointAddress):
+        {'bMaxBurst', 'bmAttributes', 'bytes_per_interval'}}
+        """
+        try:
+            with open(os.path.join(self._path, 'descriptors'), 'rb')as fp:
+                raw = fp.read()
+        except OSError:
+            return {}
+        active = int(self.read_attr('bConfigurationValue'))
+        companions = {}
+        config = interface = alt = address = None
+        # the 18 byte device descriptor comes first, then every configuration
+        offset = 18
+        while offset + 2 <= raw.__len__() and raw[offset] >= 2:
+            length, kind = raw[offset], raw[offset + 1]
+            desc = raw[offset:offset + length]
+            if kind == 0x02 and length >= 6:
+                config = desc[5]
+            elif kind == 0x04 and length >= 4:
+                interface, alt = desc[2], desc[3]
+            elif kind == 0x05 and length >= 3:
+                address = desc[2]
+            elif kind == 0x30 and length >= 6 and config == active:
+                companions[interface, alt, address] = {'bMaxBurst': desc[2],
+                                                       'bmAttributes': desc[3],
+                                                       'bytes_per_interval': int.from_bytes(desc[4:6], 'little')}
+            elif kind == 0x31 and length >= 8 and config == active:
+                # SuperSpeedPlus isochronous companion overrides wBytesPerInterval
+                companion = companions.get((interface, alt, address))
+                if companion is not None:
+                    companion['bytes_per_interval'] = int.from_bytes(desc[4:8], 'little')
+            offset += length
+        return companions
+
     def get_interface(self) -> None:
         interface_path = glob.glob(self._path + '/*:[0-9].[0-9]')
         interfaces = []
+        companions = self._companion_attr()
         for _interface in interface_path:
             interface = self._interface_attr(_interface)
             interface['end_points'] = self._get_end_point_attr(_interface)
+            if companions:
+                key = (int(self.read_attr('bInterfaceNumber', _interface), 16),
+                       int(self.read_attr('bAlternateSetting', _interface)))
+                for end_point in interface['end_points']:
+                    end_point['companion'] = companions.get(key + (end_point['bEndpointAddress'],))
             interfaces.append(interface)
         self.__setitem__('interfaces', interfaces)
 
@@ -339,7 +459,7 @@ class USBDevice(UserDict):
                                                       bInterfaceSubClass,
                                                       bInterfaceProtocol),
             'driver': driver,
-            'dev_name': USBInfo.find_dev(driver, interface_path),
+            'dev_name': USBInfo.find_dev(driver, interface_path, self._index),
             'name': os.path.split(interface_path)[-1]
         }
         return _interface
@@ -419,28 +539,357 @@ class USBDevice(UserDict):
                                                    self.idProduct)
 
 
+def usb_port_key(name: str) -> tuple:
+    """
+    'usb1' -> (1,), '1-2.10' -> (1, 2, 10), sorts a bus depth first by port
+    """
+    if name.startswith('usb'):
+        return int(name[3:]),
+    bus, _, ports = name.partition('-')
+    return (int(bus),) + tuple(int(port) for port in ports.split('.'))
+
+
+def usb_parent(name: str) -> str:
+    """
+    '1-2.3.4' -> '1-2.3', '1-2' -> 'usb1', '' for a root hub
+    """
+    if name.startswith('usb'):
+        return ''
+    bus, _, ports = name.partition('-')
+    if '.' in ports:
+        return name.rsplit('.', 1)[0]
+    return 'usb' + bus
+
+
+def usb_tree(prefix='/sys/bus/usb/devices'):
+    """
+    one scandir of prefix, returns the root hubs as
+    {'name', 'path', 'depth', 'children': [...]} nodes, children in port order
+    """
+    nodes = {}
+    try:
+        entries = list(os.scandir(prefix))
+    except FileNotFoundError:
+        return []
+    for entry in entries:
+        # interfaces look like '1-2.3:1.0'
+        if ':' in entry.name:
+            continue
+        try:
+            key = usb_port_key(entry.name)
+        except ValueError:
+            continue
+        nodes[entry.name] = ({'name': entry.name, 'path': entry.path, 'depth': 0, 'children': []}, key)
+    roots = []
+    for node, _ in sorted(nodes.values(), key=lambda item: item[1]):
+        parent = nodes.get(usb_parent(node['name']))
+        if parent is None:
+            roots.append(node)
+        else:
+            node['depth'] = parent[0]['depth'] + 1
+            parent[0]['children'].append(node)
+    return roots
+
+
+def walk_usb(nodes):
+    """
+    depth first over usb_tree() nodes
+    """
+    for node in nodes:
+        yield node
+        yield from walk_usb(node['children'])
+
+
 def find_usb():
-    prefix = '/sys/bus/usb/devices'
-    root_hub = 'usb*'
-    usb_device = '[1-9]-[1-9]'
-    usb_devices = []
-    for root in glob.glob(os.path.join(prefix, root_hub)):
-        usb_devices.append(root)
-        child_usb = glob.glob(os.path.join(root, usb_device))
-        usb_devices.extend(child_usb)
-    return usb_devices
-
-
-def list_usb(end_point=False, simple=False, json=False):
-    for usb in find_usb():
-        u = USBDevice(usb, end_point)
-        if json:
-            pprint.pprint(u.data)
-            print('\n')
+    return [node['path'] for node in walk_usb(usb_tree())]
+
+
+# share of the bus the host controller may reserve for periodic transfers,
+# keyed by bus speed in Mbps, in bytes/s
+PERIODIC_LIMIT = {
+    '1.5': 12e6 / 8 * 0.9,
+    '12': 12e6 / 8 * 0.9,
+    '480': 480e6 / 8 * 0.8,
+    '5000': 5e9 * 8 / 10 / 8 * 0.9,
+    '10000': 10e9 * 128 / 132 / 8 * 0.9,
+    '20000': 20e9 * 128 / 132 / 8 * 0.9,
+}
+
+
+def endpoint_bandwidth(end_point: dict, speed: str) -> float:
+    """
+    bytes/s reserved by a periodic (Interrupt, Isoc) endpoint, 0 for the rest,
+    SuperSpeed endpoints move up to bMaxBurst + 1 packets (times Mult + 1 for
+    Isoc) per interval as given by their companion descriptor
+    """
+    if end_point.get('type') not in ('Interrupt', 'Isoc'):
+        return 0.0
+    try:
+        mbps = float(speed)
+    except ValueError:
+        return 0.0
+    interval = max(end_point.get('bInterval', 0), 1)
+    packet = end_point.get('wMaxPacketSize', 0)
+    if mbps >= 480:
+        # 2^(bInterval-1) microframes, high speed packs extra transactions in bits 12:11
+        seconds = 2 ** (min(interval, 16) - 1) * 125e-6
+        if mbps == 480:
+            packet = (packet & 0x7ff) * (((packet >> 11) & 3) + 1)
+        elif end_point.get('companion'):
+            companion = end_point['companion']
+            packet = companion['bytes_per_interval']
+            if not packet:
+                mult = (companion['bmAttributes'] & 3) + 1 if end_point.get('type') == 'Isoc' else 1
+                packet = end_point.get('wMaxPacketSize', 0) * (companion['bMaxBurst'] + 1) * mult
+    elif end_point.get('type') == 'Isoc':
+        seconds = 2 ** (min(interval, 16) - 1) * 1e-3
+    else:
+        seconds = interval * 1e-3
+    return packet / seconds
+
+
+def device_bandwidth(usb_device) -> float:
+    used = 0.0
+    for interface in usb_device.interfaces:
+        for end_point in interface['end_points']:
+            used += endpoint_bandwidth(end_point, usb_device.speed)
+    return used
+
+
+def bandwidth_budget(devices=None):
+    """
+    periodic bandwidth reserved per bus and per root port against the bus limit,
+    devices is a list of (usb_tree node, USBDevice), heaviest users first
+    """
+    if devices is None:
+        index = SysfsIndex()
+        devices = [(node, USBDevice(node['path'], index=index)) for node in walk_usb(usb_tree())]
+    buses = {}
+    for node, u in devices:
+        name = node['name']
+        bus_id = name[3:] if name.startswith('usb') else name.split('-')[0]
+        bus = buses.setdefault(bus_id, {'bus': bus_id, 'speed': '', 'limit': 0.0, 'used': 0.0,
+                                        'ports': {}, 'devices': []})
+        if name.startswith('usb'):
+            bus['speed'] = u.speed
+            bus['limit'] = PERIODIC_LIMIT.get(u.speed, 0.0)
+            continue
+        used = device_bandwidth(u)
+        if not used:
+            continue
+        root_port = name.split('.')[0]
+        bus['used'] += used
+        bus['ports'][root_port] = bus['ports'].get(root_port, 0.0) + used
+        bus['devices'].append({'name': name, 'product': u.name, 'speed': u.speed, 'used': used})
+    for bus in buses.values():
+        bus['headroom'] = bus['limit'] - bus['used']
+        bus['devices'].sort(key=lambda dev: dev['used'], reverse=True)
+    return [buses[bus] for bus in sorted(buses, key=int)]
+
+
+def print_bandwidth_budget(devices=None):
+    for bus in bandwidth_budget(devices):
+        print('bus {} [{} Mbps] periodic {:.3f}/{:.3f} MB/s, headroom {:.3f} MB/s'.format(
+            bus['bus'], bus['speed'], bus['used'] / 1e6, bus['limit'] / 1e6, bus['headroom'] / 1e6))
+        for port, used in sorted(bus['ports'].items()):
+            print('|__ port {} {:.3f} MB/s'.format(port, used / 1e6))
+        for dev in bus['devices']:
+            print('    {} [{} Mbps] {:.3f} MB/s {}'.format(dev['name'], dev['speed'], dev['used'] / 1e6, dev['product']))
+
+
+def usb_port_path(name: str, prefix='/sys/bus/usb/devices') -> str:
+    """
+    port directory of the hub a device is plugged into,
+    '1-2.3' -> 1-2/1-2:1.0/1-2-port3, '1-2' -> usb1/1-0:1.0/usb1-port2
+    """
+    parent = usb_parent(name)
+    port = name.rsplit('.', 1)[-1] if '.' in name else name.split('-', 1)[1]
+    if parent.startswith('usb'):
+        hub_interface = '{}-0:1.0'.format(parent[3:])
+    else:
+        hub_interface = parent + ':1.0'
+    return os.path.join(prefix, parent, hub_interface, '{}-port{}'.format(parent, port))
+
+
+# BOS device capability types announcing SuperSpeed and SuperSpeedPlus
+USB_SS_CAP_TYPE = 0x03
+USB_SSP_CAP_TYPE = 0x0a
+
+
+def superspeed_capable(usb_device):
+    """
+    True or False from the SuperSpeed capabilities in bos_descriptors (kernel
+    6.7+), without them bcdUSB >= 3.0 is True and 2.10 None: a SuperSpeed
+    device that enumerated at high speed reports 2.10, so do USB 2 only ones
+    """
+    try:
+        with open(os.path.join(usb_device._path, 'bos_descriptors'), 'rb')as fp:
+            bos = fp.read()
+    except OSError:
+        bos = b''
+    if bos.__len__() >= 5 and bos[1] == 0x0f:
+        offset = bos[0]
+        while offset + 3 <= bos.__len__() and bos[offset] >= 3:
+            if bos[offset + 1] == 0x10 and bos[offset + 2] in (USB_SS_CAP_TYPE, USB_SSP_CAP_TYPE):
+                return True
+            offset += bos[offset]
+        return False
+    try:
+        version = float(usb_device.version)
+    except ValueError:
+        return False
+    if version >= 3.0:
+        return True
+    return None if version >= 2.1 else False
+
+
+def speed_report(devices=None, prefix='/sys/bus/usb/devices'):
+    """
+    SuperSpeed capable devices that enumerated below 5000 Mbps, a port with a
+    'peer' has a SuperSpeed twin, so the first port on the way down from the
+    root without one is the limiting link; without bos_descriptors a bcdUSB
+    2.10 device is only a candidate when its own port has a SuperSpeed peer,
+    which also matches USB 2 only devices with BOS descriptors; a device whose
+    peer port has a device of its own is the USB 2 half of a USB 3 hub
+    """
+    if devices is None:
+        index = SysfsIndex()
+        devices = [(node, USBDevice(node['path'], index=index)) for node in walk_usb(usb_tree(prefix))]
+    report = []
+    for node, u in devices:
+        name = node['name']
+        if name.startswith('usb'):
+            continue
+        try:
+            if float(u.speed) >= 5000:
+                continue
+        except ValueError:
+            continue
+        capable = superspeed_capable(u)
+        if capable is False:
+            continue
+        peer = os.path.join(usb_port_path(name, prefix), 'peer')
+        if capable is None and not os.path.exists(peer):
+            continue
+        if os.path.exists(os.path.join(peer, 'device')):
+            # the SuperSpeed twin port is in use: this is the USB 2 half of a USB 3 hub
+            continue
+        hops = [name]
+        while not usb_parent(hops[0]).startswith('usb'):
+            hops.insert(0, usb_parent(hops[0]))
+        limit, where = 'device', name
+        # the device or its cable, unless a port on the way lacks a SuperSpeed peer
+        for hop in hops:
+            port_path = usb_port_path(hop, prefix)
+            if not os.path.exists(os.path.join(port_path, 'peer')):
+                limit = 'root port' if usb_parent(hop).startswith('usb') else 'hub'
+                where = os.path.basename(port_path)
+                break
+        report.append({'name': name,
+                       'product': u.name,
+                       'version': u.version,
+                       'speed': u.speed,
+                       'certain': capable is True,
+                       'limit': limit,
+                       'at': where,
+                       'path': hops})
+    return report
+
+
+def print_speed_report(devices=None):
+    for entry in speed_report(devices):
+        print('{} USB {} at {} Mbps, limited by {} {} ({}){}'.format(
+            entry['name'], entry['version'], entry['speed'], entry['limit'], entry['at'], entry['product'],
+            '' if entry['certain'] else ' [bcdUSB only]'))
+
+
+def latency_sensitive(usb_device) -> list:
+    """
+    names of HID interfaces and interfaces with isochronous endpoints
+    """
+    interfaces = []
+    for interface in usb_device.interfaces:
+        if interface['bInterfaceClass'] == 0x03 or \
+                any(end_point['type'] == 'Isoc' for end_point in interface['end_points']):
+            interfaces.append(interface['name'])
+    return interfaces
+
+
+def power_audit(devices=None, samples=5, interval=1.0, prefix='/sys/bus/usb/devices'):
+    """
+    sample runtime_status/runtime_suspended_time of every device to count how
+    often it suspends, flag latency sensitive devices with autosuspend enabled
+    """
+    if devices is None:
+        index = SysfsIndex()
+        devices = [(node, USBDevice(node['path'], index=index)) for node in walk_usb(usb_tree(prefix))]
+    states = {node['name']: [(u.power['runtime_status'], u.power['runtime_suspended_time'])]
+              for node, u in devices}
+    for _ in range(samples - 1):
+        time.sleep(interval)
+        for node, u in devices:
+            power = u._power_attr()
+            states[node['name']].append((power['runtime_status'], power['runtime_suspended_time']))
+    report = []
+    for node, u in devices:
+        suspends = 0
+        history = states[node['name']]
+        for (status, suspended), (new_status, new_suspended) in zip(history, history[1:]):
+            # a suspend entered between two samples shows up as one or the other
+            if (status != 'suspended' and new_status == 'suspended') or \
+                    (status == 'active' and new_suspended > suspended):
+                suspends += 1
+        sensitive = latency_sensitive(u)
+        autosuspend = u.power['control'] == 'auto' and u.power['autosuspend_delay_ms'] >= 0
+        report.append({'name': node['name'],
+                       'product': u.name,
+                       'control': u.power['control'],
+                       'autosuspend_delay_ms': u.power['autosuspend_delay_ms'],
+                       'suspends': suspends,
+                       'latency_sensitive': sensitive,
+                       'flagged': bool(sensitive) and autosuspend})
+    return report
+
+
+def print_power_audit(devices=None):
+    for entry in power_audit(devices):
+        print('{:<8} {} control {} delay {} ms, suspended {} times{} {}'.format(
+            'LATENCY' if entry['flagged'] else 'ok',
+            entry['name'],
+            entry['control'],
+            entry['autosuspend_delay_ms'],
+            entry['suspends'],
+            ' [{}]'.format(' '.join(entry['latency_sensitive'])) if entry['latency_sensitive'] else '',
+            entry['product']))
+
+
+def list_usb(end_point=False, simple=False, json=False, tree=False, out=sys.stdout):
+    """
+    json=True or 'ndjson' writes one compact JSON object per line as soon as
+    each device is built, json='document' writes a single JSON array
+    """
+    index = SysfsIndex()
+    encoder = JSONEncoder(separators=(',', ':'))
+    count = 0
+    if json == 'document':
+        out.write('[')
+    for node in walk_usb(usb_tree()):
+        u = USBDevice(node['path'], end_point, index)
+        if json == 'document':
+            out.write(',' if count else '')
+            out.write(encoder.encode(u.data))
+        elif json:
+            out.write(encoder.encode(u.data) + '\n')
+            out.flush()
+        elif tree:
+            print('    ' * node['depth'] + u.__repr__(), file=out)
         elif simple:
-            print(u.__repr__())
+            print(u.__repr__(), file=out)
         else:
-            print(u)
+            print(u, file=out)
+        count += 1
+    if json == 'document':
+        out.write(']\n')
 
 
 if __name__ == '__main__':
@@ -448,14 +897,27 @@ if __name__ == '__main__':
         arg = sys.argv[1]
     except IndexError:
         arg = None
-    e, s, j = False, False, False
+    e, s, j, t = False, False, False, False
     if arg == '-s':
         s = True
     elif arg == '-j':
-        j = True
+        j = 'ndjson'
+    elif arg == '-J':
+        j = 'document'
     elif arg == '-e':
         e = True
+    elif arg == '-t':
+        t = True
+    elif arg == '-b':
+        print_bandwidth_budget()
+        sys.exit(0)
+    elif arg == '-m':
+        print_speed_report()
+        sys.exit(0)
+    elif arg == '-p':
+        print_power_audit()
+        sys.exit(0)
     elif arg == '-h':
-        print('Usage:\n\t-s  simple\n\t-j  json\n\t-e  show endpoint\n\t-h  show this')
+        print('Usage:\n\t-s  simple\n\t-j  json, one object per line\n\t-J  json, one document\n\t-e  show endpoint\n\t-t  tree\n\t-b  periodic bandwidth budget\n\t-m  negotiated speed mismatch\n\t-p  autosuspend audit\n\t-h  show this')
         sys.exit(0)
-    list_usb(e, s, j)
+    list_usb(e, s, j, t)
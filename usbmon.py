@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+import os
+import queue
+import sys
+import threading
+import time
+from usb import SysfsIndex, USBDevice, usb_tree, walk_usb
+
+USBMON_PATH = '/sys/kernel/debug/usb/usbmon'
+READ_SIZE = 256 * 1024
+# the text interface hands out one event per read()
+EVENT_SIZE = 4096
+# timestamps are (seconds & 0xfff) * 10^6 + microseconds
+TIMESTAMP_WRAP = 4096 * 10 ** 6
+# iso frame descriptors printed per event, ISODESC_MAX in mon_text.c
+ISO_DESC_MAX = 5
+
+
+class UsbmonParser:
+    """
+    incremental parser for the usbmon text interface ('1u' format):
+        d5ea89a0 3575914560 C Ii:1:003:1 0 4 = 01050000
+        tag      timestamp  event  type/dir:bus:device:endpoint  status  length  data
+    only completions (C) and errors (E) are counted, per (bus, device, endpoint)
+    """
+    def __init__(self):
+        self._tail = b''
+        self.stats = {}
+        self.first = None
+        self.last = None
+        # seconds actually sampled, set by sample()
+        self.duration = None
+        self.lines = 0
+
+    def feed(self, data: bytes):
+        lines = (self._tail + data).split(b'\n')
+        self._tail = lines.pop()
+        for line in lines:
+            self.parse_line(line)
+
+    def close(self):
+        if self._tail:
+            self.parse_line(self._tail)
+            self._tail = b''
+
+    def parse_line(self, line: bytes):
+        # the data words after ' = ' are never needed
+        fields = line.partition(b' = ')[0].split()
+        if fields.__len__() < 5:
+            return
+        event = fields[2]
+        if event != b'C' and event != b'E':
+            return
+        try:
+            timestamp = int(fields[1])
+            urb_type, bus, device, end_point = fields[3].split(b':')
+            # iso completions report 'status:start_frame:error_count'
+            status = int(fields[4].split(b':', 1)[0])
+        except ValueError:
+            return
+        # the length follows the status word and, for iso, the frame descriptors,
+        # a data tag ('<', '>', 'D', 'Z', ...) may come after it
+        try:
+            index = 5
+            if urb_type[:1] == b'Z':
+                index += 1 + min(int(fields[5]), ISO_DESC_MAX)
+            length = int(fields[index]) if event == b'C' else 0
+        except (ValueError, IndexError):
+            length = 0
+        self.lines += 1
+        if self.first is None:
+            self.first = timestamp
+        self.last = timestamp
+        end_point = int(end_point)
+        if end_point and urb_type[1:2] == b'i':
+            end_point |= 0x80
+        key = (int(bus), int(device), end_point)
+        counter = self.stats.get(key)
+        if counter is None:
+            counter = self.stats[key] = {'type': urb_type[:1].decode(), 'urbs': 0, 'bytes': 0, 'errors': {}}
+        counter['urbs'] += 1
+        counter['bytes'] += length
+        if status and status != -115:
+            # -115 (EINPROGRESS) is the normal submit status of iso frames
+            counter['errors'][status] = counter['errors'].get(status, 0) + 1
+
+    @property
+    def elapsed(self) -> float:
+        """
+        seconds between the first and last counted event, timestamps are
+        microseconds that wrap every 4096 seconds
+        """
+        if self.first is None:
+            return 0.0
+        return ((self.last - self.first) % TIMESTAMP_WRAP) / 1e6
+
+
+def read_capture(path, parser=None):
+    """
+    parse a recorded usbmon capture file
+    """
+    parser = parser or UsbmonParser()
+    with open(path, 'rb')as fp:
+        for chunk in iter(lambda: fp.read(READ_SIZE), b''):
+            parser.feed(chunk)
+    parser.close()
+    return parser
+
+
+def _read_events(fd, events, stop):
+    """
+    blocking reads of the usbmon text file, which has no poll support, the fd
+    is closed here once the read in progress returns after stop is set
+    """
+    try:
+        while not stop.is_set():
+            data = os.read(fd, EVENT_SIZE)
+            if not data or stop.is_set():
+                break
+            events.put(data)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def sample(bus=0, duration=1.0, parser=None):
+    """
+    read the live usbmon stream of bus (0 for all buses) for duration seconds
+    """
+    parser = parser or UsbmonParser()
+    fd = os.open(os.path.join(USBMON_PATH, '{}u'.format(bus)), os.O_RDONLY)
+    events = queue.Queue()
+    stop = threading.Event()
+    reader = threading.Thread(target=_read_events, args=(fd, events, stop), daemon=True)
+    reader.start()
+    start = time.monotonic()
+    end = start + duration
+    try:
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                parser.feed(events.get(timeout=remaining))
+            except queue.Empty:
+                break
+    finally:
+        # an idle bus leaves the reader blocked until its next event
+        stop.set()
+        parser.duration = time.monotonic() - start
+    while True:
+        try:
+            parser.feed(events.get_nowait())
+        except queue.Empty:
+            break
+    parser.close()
+    return parser
+
+
+def attribute(parser, devices=None, elapsed=None):
+    """
+    per device and per interface URBs/s, bytes/s and error counts, matched
+    through busnum/devnum and bEndpointAddress, rates are over the sampled
+    duration of a live capture, the first to last event span of a recorded one
+    """
+    if devices is None:
+        index = SysfsIndex()
+        devices = [USBDevice(node['path'], index=index) for node in walk_usb(usb_tree())]
+    elapsed = elapsed or parser.duration or parser.elapsed or 1.0
+    by_address = {}
+    for u in devices:
+        try:
+            by_address[int(u.bus_id), int(u.dev_id)] = u
+        except ValueError:
+            continue
+    report = {}
+    for (bus, device, address), counter in sorted(parser.stats.items()):
+        u = by_address.get((bus, device))
+        name = os.path.basename(u._path) if u is not None else '{}:{:03d}'.format(bus, device)
+        entry = report.setdefault(name, {'product': u.name if u is not None else '',
+                                         'urbs': 0.0, 'bytes': 0.0, 'errors': {}, 'interfaces': {}})
+        interface = 'ep_00' if u is not None else '-'
+        if u is not None and address & 0x7f:
+            for _interface in u.interfaces:
+                if any(end_point['bEndpointAddress'] == address for end_point in _interface['end_points']):
+                    interface = _interface['name']
+                    break
+        rates = entry['interfaces'].setdefault(interface, {'urbs': 0.0, 'bytes': 0.0, 'errors': {}, 'end_points': {}})
+        rates['end_points']['{:02x}'.format(address)] = {'type': counter['type'],
+                                                         'urbs': counter['urbs'] / elapsed,
+                                                         'bytes': counter['bytes'] / elapsed,
+                                                         'errors': dict(counter['errors'])}
+        for target in (entry, rates):
+            target['urbs'] += counter['urbs'] / elapsed
+            target['bytes'] += counter['bytes'] / elapsed
+            for status, count in counter['errors'].items():
+                target['errors'][status] = target['errors'].get(status, 0) + count
+    return report
+
+
+def print_report(report):
+    for name, entry in report.items():
+        print('{} {:.1f} URB/s {:.1f} kB/s errors {} {}'.format(
+            name, entry['urbs'], entry['bytes'] / 1e3, entry['errors'], entry['product']))
+        for interface, rates in entry['interfaces'].items():
+            print('|__ {} {:.1f} URB/s {:.1f} kB/s errors {}'.format(
+                interface, rates['urbs'], rates['bytes'] / 1e3, rates['errors']))
+            for address, end_point in rates['end_points'].items():
+                print('\t|__ {} {} {:.1f} URB/s {:.1f} kB/s'.format(
+                    address, end_point['type'], end_point['urbs'], end_point['bytes'] / 1e3))
+
+
+if __name__ == '__main__':
+    try:
+        arg = sys.argv[1]
+    except IndexError:
+        arg = '0'
+    if arg == '-h':
+        print('Usage:\n\t[bus]      sample the live stream of bus for a second, 0 for all'
+              '\n\t-r <file>  parse a recorded capture\n\t-h         show this')
+        sys.exit(0)
+    if arg == '-r':
+        print_report(attribute(read_capture(sys.argv[2])))
+    else:
+        print_report(attribute(sample(int(arg))))